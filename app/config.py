@@ -15,9 +15,23 @@ class Settings(BaseSettings):
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 10080
 
     CHROMA_PERSIST_DIR: str = "./chroma_db"
+    # HNSW index parameters, applied when the collection is first created
+    CHROMA_HNSW_M: int = 32
+    CHROMA_HNSW_CONSTRUCTION_EF: int = 200
+    CHROMA_HNSW_SEARCH_EF: int = 64
+    CHROMA_ADD_BATCH_SIZE: int = 500  # Chunks per collection.add call
+    CHROMA_ADD_WORKERS: int = 4  # Concurrent collection.add calls during upload
+    CHROMA_DELETE_BATCH_SIZE: int = 1000  # IDs per collection.delete call when deleting by ID
 
     EMBEDDING_MODEL: str = "multi-qa-mpnet-base-dot-v1"
     EMBEDDING_DEVICE: str = "cpu"
+    # "torch" (PyTorch on EMBEDDING_DEVICE) or "onnx-int8" (quantized ONNX Runtime, CPU only)
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_ONNX_DIR: str = "./models/onnx"  # Cached INT8 ONNX exports
+    # Storage precision for cached query embeddings: float32, float16 or int8.
+    # Chroma's HNSW index always stores float32, so this applies to the in-process caches.
+    # float16/int8 are lossy: cached query vectors sent to Chroma are perturbed.
+    EMBEDDING_PRECISION: str = "float32"
 
     HOST: str = "0.0.0.0"
     PORT: int = 8000
@@ -38,9 +52,24 @@ class Settings(BaseSettings):
 
     # Advanced retrieval settings
     ENABLE_LLM_EXPANSION: bool = True  # Use LLM for query understanding
+    EXPANSION_SKIP_SIMILARITY: float = 0.80  # Skip LLM expansion above this top-1 similarity
+    # Start LLM expansion alongside the initial search (lower latency, but the
+    # Groq call is made even when EXPANSION_SKIP_SIMILARITY then skips it)
+    EXPANSION_OVERLAP_SEARCH: bool = False
     RETRIEVAL_CANDIDATES: int = 50  # Initial candidates to retrieve
     MAX_CHUNKS_PER_DOC: int = 3  # Max chunks from same document (diversity)
 
+    # Query caching
+    QUERY_EMBEDDING_CACHE_SIZE: int = 1024  # Exact-text query embedding LRU
+    QUERY_RESULT_CACHE_SIZE: int = 256  # Cached Chroma query results
+    QUERY_RESULT_CACHE_TTL: int = 300  # Seconds
+    QUERY_CACHE_SIMILARITY: float = 0.97  # Cosine similarity for a semantic cache hit
+    EXPANSION_CACHE_SIZE: int = 2048  # Cached LLM query expansions (persisted in CHROMA_PERSIST_DIR)
+    EXPANSION_CACHE_TTL: int = 86400  # Seconds
+    USER_DOCS_CACHE_SIZE: int = 1024  # Cached per-user document listings
+    USER_DOCS_CACHE_TTL: int = 30  # Seconds
+    COLLECTION_COUNT_CACHE_TTL: float = 5.0  # Seconds get_collection_count may be stale
+
     @property
     def origins_list(self) -> List[str]:
         return [origin.strip() for origin in self.ALLOWED_ORIGINS.split(",")]
@@ -48,7 +48,7 @@ async def stream_sse_response(
         initial_retrieve = 50  # Retrieve many candidates
         top_k = min(settings.TOP_K_CHUNKS * 3, 20)  # Return more for context
 
-        results = ChromaDB.search_with_reranking(
+        results = await ChromaDB.search_with_reranking(
             query_text=query,
             n_results=top_k,
             retrieve_count=initial_retrieve,  # Cast very wide net
@@ -3,7 +3,8 @@ Document upload and management routes.
 Protected by JWT authentication and rate limiting.
 """
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Request
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Request, Query
+from typing import Optional
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 import os
@@ -107,10 +108,10 @@ async def upload_document(
             chunk_ids.append(chunk_id)
             chunk_texts.append(chunk)
             metadatas.append({
+                "user_id": current_user.user_id,
                 "doc_id": doc_id,
                 "chunk_id": chunk_id,
                 "filename": file.filename,
-                "user_id": current_user.user_id,
                 "upload_date": datetime.utcnow().isoformat(),
                 "chunk_index": i
             })
@@ -175,7 +176,7 @@ async def delete_document(
                 detail="Unauthorized to delete this document"
             )
 
-        ChromaDB.delete_by_doc_id(doc_id)
+        ChromaDB.delete_by_doc_id(doc_id, user_id=current_user.user_id)
 
         logger.info(f"Document deleted: {doc_id}")
 
@@ -215,18 +216,22 @@ async def get_stats(current_user: TokenData = Depends(get_current_user)):
 
 
 @router.get("/list")
-async def list_documents(current_user: TokenData = Depends(get_current_user)):
+async def list_documents(
+    limit: Optional[int] = Query(None, ge=1),
+    current_user: TokenData = Depends(get_current_user)
+):
     """
-    List all documents for the current user.
+    List documents for the current user, newest first.
 
     Args:
+        limit: Return only the most recent `limit` documents
         current_user: Authenticated user
 
     Returns:
         List of user documents with metadata
     """
     try:
-        user_docs = ChromaDB.get_user_documents(current_user.user_id)
+        user_docs = ChromaDB.get_user_documents(current_user.user_id, limit=limit)
 
         return {
             "success": True,
@@ -0,0 +1,172 @@
+"""
+Numba kernel for the hybrid reranking score used by ChromaDB.search_with_reranking.
+
+Per-candidate features (ratio features, exclusion boost, multi-match bonus,
+length normalization) are computed in one compiled pass over the candidate
+arrays; the query-type weighted sum is a generated function per query type
+with its weights baked in. Without numba the same code runs as plain
+Python loops.
+"""
+
+import textwrap
+from typing import Callable, Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit."""
+        def decorator(func):
+            return func
+        return decorator
+
+
+# Hybrid reranking features, in column order
+SCORE_FEATURES = (
+    'semantic', 'lexical', 'concepts', 'hyde', 'exclusions',
+    'context', 'multi_match', 'length', 'metadata'
+)
+
+# Adaptive weights per query type (rows follow QUERY_TYPES). The
+# multi_match weight includes the universal 0.1 multi-match bonus.
+QUERY_TYPES = ('definition', 'exclusion', 'coverage', 'general')
+SCORE_WEIGHTS = np.array([
+    # For definitions, prioritize semantic + concept coverage
+    [0.40, 0.15, 0.25, 0.10, 0.00, 0.05, 0.15, 0.00, 0.00],
+    # For exclusions, heavily weight exclusion terms
+    [0.30, 0.20, 0.00, 0.00, 0.30, 0.10, 0.20, 0.00, 0.00],
+    # For coverage, balance semantic + lexical + concepts
+    [0.35, 0.25, 0.15, 0.10, 0.00, 0.10, 0.15, 0.00, 0.00],
+    # General balanced scoring
+    [0.35, 0.20, 0.15, 0.10, 0.08, 0.07, 0.10, 0.03, 0.02],
+])
+
+
+def query_type_id(query_type: str) -> int:
+    """Row of SCORE_WEIGHTS for a query type; unknown types score as general."""
+    if query_type in QUERY_TYPES:
+        return QUERY_TYPES.index(query_type)
+    return QUERY_TYPES.index('general')
+
+
+def feature_weight(query_type: int, feature: str) -> float:
+    """Weight of a SCORE_FEATURES column for a query type row."""
+    return float(SCORE_WEIGHTS[query_type, SCORE_FEATURES.index(feature)])
+
+
+def _compile_score_rows(weights: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Generate the scoring function for one SCORE_WEIGHTS row.
+
+    The weights are baked in as constants and zero-weight features are
+    dropped, so each query type gets a straight-line weighted sum (jitted
+    when numba is available) instead of a loop over a weight vector.
+    """
+    terms = [
+        f"{weight!r} * features[i, {col}]"
+        for col, weight in enumerate(weights.tolist()) if weight
+    ]
+    source = textwrap.dedent(f"""\
+        def score_rows(features):
+            scores = np.empty(features.shape[0])
+            for i in range(features.shape[0]):
+                scores[i] = min({' + '.join(terms) or '0.0'}, 1.0)
+            return scores
+    """)
+    namespace = {'np': np}
+    exec(source, namespace)
+    return njit(fastmath=True)(namespace['score_rows'])
+
+
+# One specialized scoring function per QUERY_TYPES row
+_SCORE_FUNCS = tuple(_compile_score_rows(row) for row in SCORE_WEIGHTS)
+
+
+# Serial on purpose: candidate lists are small (tens of rows) and searches
+# call this concurrently from worker threads, which numba's default
+# workqueue threading layer does not allow for parallel kernels
+@njit(fastmath=True, cache=True)
+def _feature_kernel(
+    distances, concept_hits, concept_total, exclusion_hits, exclusion_total,
+    exclusion_boost, context_hits, context_total, lengths, n_matches,
+    metadata_scores, lex_scores, hyde_scores
+):
+    n_candidates = distances.shape[0]
+    features = np.empty((n_candidates, 9))
+
+    for i in range(n_candidates):
+        # Semantic similarity from cosine distance
+        features[i, 0] = 1.0 - min(distances[i], 1.0)
+        features[i, 1] = lex_scores[i]
+        features[i, 2] = concept_hits[i] / max(concept_total, 1.0)
+        features[i, 3] = hyde_scores[i]
+        features[i, 4] = exclusion_hits[i] / max(exclusion_total, 1.0) * exclusion_boost
+        features[i, 5] = context_hits[i] / max(context_total, 1.0)
+        features[i, 6] = min(n_matches[i] * 0.05, 0.2)
+        # Very short chunks might be incomplete; normalize to 500 chars
+        features[i, 7] = min(lengths[i] / 500.0, 1.0)
+        features[i, 8] = metadata_scores[i]
+
+    return features
+
+
+def _f64(values) -> np.ndarray:
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+def score_candidates(
+    sem_distances: np.ndarray,
+    concept_hits: np.ndarray,
+    concept_total: int,
+    exclusion_hits: np.ndarray,
+    exclusion_total: int,
+    context_hits: np.ndarray,
+    context_total: int,
+    lengths: np.ndarray,
+    n_matches: np.ndarray,
+    query_type: int,
+    lex_scores: np.ndarray,
+    hyde_scores: np.ndarray,
+    metadata_scores: np.ndarray,
+    exclusion_boost: float = 1.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score reranking candidates.
+
+    Args:
+        sem_distances: Cosine distance of each candidate from the query
+        concept_hits / exclusion_hits / context_hits: Matched term counts
+        concept_total / exclusion_total / context_total: Term list sizes
+        lengths: Candidate text lengths in characters
+        n_matches: Number of query variants that retrieved each candidate
+        query_type: Row index into SCORE_WEIGHTS (see query_type_id)
+        lex_scores / hyde_scores: Best lexical score vs variants / HyDE answers
+        metadata_scores: Metadata relevance (e.g. filename match)
+        exclusion_boost: Multiplier on the exclusion feature
+
+    Returns:
+        (scores, features) where features has one column per SCORE_FEATURES
+    """
+    features = _feature_kernel(
+        _f64(sem_distances),
+        _f64(concept_hits), float(concept_total),
+        _f64(exclusion_hits), float(exclusion_total),
+        float(exclusion_boost),
+        _f64(context_hits), float(context_total),
+        _f64(lengths), _f64(n_matches), _f64(metadata_scores),
+        _f64(lex_scores), _f64(hyde_scores)
+    )
+    return _SCORE_FUNCS[query_type](features), features
+
+
+def warmup():
+    """Compile the kernels for every query type ahead of the first search."""
+    one = np.zeros(1)
+    for query_type in range(len(QUERY_TYPES)):
+        score_candidates(one, one, 0, one, 0, one, 0, one, one,
+                         query_type, one, one, one)
@@ -6,80 +6,236 @@ Enhanced with LLM-powered query understanding and multi-strategy retrieval.
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any, Optional
+import torch
+from typing import List, Dict, Any, NamedTuple, Optional, Set, Tuple, Union
 from loguru import logger
-from groq import Groq
+from groq import AsyncGroq
 import asyncio
+from contextlib import contextmanager
+import functools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+import orjson
 
 from app.config import settings
+from app.services.rerank_numba import (
+    SCORE_FEATURES, feature_weight, query_type_id, score_candidates,
+    warmup as warmup_reranker
+)
 import re
-import difflib
 import math
+from array import array
+from cachetools import TTLCache
+from collections import Counter, OrderedDict, deque
+import numpy as np
+import pandas as pd
+
+try:
+    import ahocorasick
+    _AHOCORASICK_AVAILABLE = True
+except ImportError:
+    # pyahocorasick not available — fall back to per-hint substring checks
+    _AHOCORASICK_AVAILABLE = False
+
+try:
+    from nltk.corpus import wordnet as wn
+    wn.ensure_loaded()
+    _WN_AVAILABLE = True
+except Exception:
+    # nltk/wordnet not available — that's fine
+    _WN_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows — cache file writes are then only thread-safe
+    fcntl = None
+
+_ALNUM = re.compile(r"[^a-z0-9\s]")
+_WS = re.compile(r"\s+")
+
+# Filler words dropped from lexical query variants
+_FILLERS = frozenset({"the", "a", "an", "that", "this", "these",
+                      "those", "was", "is", "are", "be", "been", "just"})
 
 
 def normalize_text(s: str) -> str:
     """Lowercase, remove punctuation and collapse whitespace."""
-    s = s or ""
-    s = s.lower()
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    return _WS.sub(" ", _ALNUM.sub(" ", (s or "").lower())).strip()
 
 
 def tokenize(s: str) -> List[str]:
     return [t for t in normalize_text(s).split() if t]
 
 
-def calculate_lexical_score(query: str, text: str) -> float:
+# Width of the per-chunk token bitset (a 1024-bit hashed token signature)
+_TOKEN_BITS = 1024
+
+
+def _token_bits(tokens) -> int:
+    """Hashed token-presence bitset; a zero AND of two bitsets means no shared token.
+
+    Uses crc32 rather than hash() so bitsets stored at ingest stay valid
+    across processes.
+    """
+    bits = 0
+    for tok in set(tokens):
+        bits |= 1 << (zlib.crc32(tok.encode()) % _TOKEN_BITS)
+    return bits
+
+
+def _lcs_tokens(a: List[str], b: List[str]) -> int:
+    """Length of the longest common token subsequence (single rolling DP row)."""
+    if len(a) < len(b):
+        a, b = b, a  # keep the DP row over the shorter sequence
+    row = array('i', [0] * (len(b) + 1))
+    for x in a:
+        diag = 0
+        for j, y in enumerate(b, 1):
+            up = row[j]
+            if x == y:
+                row[j] = diag + 1
+            elif row[j - 1] > up:
+                row[j] = row[j - 1]
+            diag = up
+    return row[len(b)]
+
+
+class _LexicalQuery(NamedTuple):
+    """Query-side lexical features, computed once per distinct query text."""
+    tokens: Tuple[str, ...]
+    bigrams: Tuple[Tuple[str, str], ...]
+
+
+@functools.lru_cache(maxsize=4096)
+def _prepare_lexical_query(query: str) -> _LexicalQuery:
+    """Tokenize a query once; repeated variants (e.g. from cached expansions) hit the cache."""
+    tokens = tuple(tokenize(query))
+    return _LexicalQuery(tokens, tuple(zip(tokens[:-1], tokens[1:])))
+
+
+def calculate_lexical_score(
+    query: Union[str, _LexicalQuery],
+    text: str,
+    t_tokens: Optional[List[str]] = None
+) -> float:
     """Advanced lexical similarity with BM25-inspired scoring.
 
     Combines:
     - Token overlap (Jaccard similarity)
     - BM25-like term frequency weighting
     - Phrase/bigram matching
-    - Sequence similarity
-    Returns 0..1 float.
+    - Token-level sequence (LCS) similarity
+    Returns 0..1 float. query may be a _prepare_lexical_query result; pass
+    t_tokens to reuse an existing tokenize(text).
+    Single-pair form of _batch_lexical_scores.
     """
-    q_tokens = tokenize(query)
-    t_tokens = tokenize(text)
-    q_token_set = set(q_tokens)
-    t_token_set = set(t_tokens)
-
-    if not q_token_set or not t_token_set:
-        return 0.0
+    doc_tokens = None if t_tokens is None else [t_tokens]
+    return float(_batch_lexical_scores([query], [text], doc_tokens)[0, 0])
+
+
+def _batch_lexical_scores(
+    queries: List[Union[str, _LexicalQuery]],
+    docs: List[str],
+    doc_tokens: Optional[List[List[str]]] = None,
+    doc_counts: Optional[List[Counter]] = None,
+    doc_bits: Optional[List[Optional[int]]] = None
+) -> np.ndarray:
+    """Lexical scores for every (doc, query) pair as a len(docs) x len(queries) array.
+
+    Term counts are gathered once into a docs x vocab matrix over the query
+    vocabulary, so Jaccard, saturated TF, bigram overlap and coverage are
+    computed as matrix products rather than per-pair set operations. Only
+    the LCS term is still evaluated pair by pair. Pass doc_counts
+    (Counter(doc_tokens[i])) to reuse term frequencies built by the caller,
+    and doc_bits (_token_bits of each doc, None if unknown) to skip docs
+    sharing no term with any query. Queries may be given as text or as
+    _prepare_lexical_query results.
+    """
+    if doc_tokens is None:
+        doc_tokens = [tokenize(d) for d in docs]
+    if doc_counts is None:
+        doc_counts = [Counter(toks) for toks in doc_tokens]
+    prepared = [
+        q if isinstance(q, _LexicalQuery) else _prepare_lexical_query(q)
+        for q in queries
+    ]
+    q_tokens = [q.tokens for q in prepared]
+    n_docs, n_queries = len(doc_tokens), len(q_tokens)
+
+    # Vocabularies of query terms and query bigrams
+    vocab: Dict[str, int] = {}
+    bigram_vocab: Dict[Tuple[str, str], int] = {}
+    for q in prepared:
+        for tok in q.tokens:
+            vocab.setdefault(tok, len(vocab))
+        for bigram in q.bigrams:
+            bigram_vocab.setdefault(bigram, len(bigram_vocab))
+
+    # Query side: term multiplicities and bigram presence
+    q_counts = np.zeros((n_queries, len(vocab)))
+    q_bigrams = np.zeros((n_queries, len(bigram_vocab)))
+    for j, q in enumerate(prepared):
+        for tok in q.tokens:
+            q_counts[j, vocab[tok]] += 1
+        for bigram in q.bigrams:
+            q_bigrams[j, bigram_vocab[bigram]] = 1
+
+    # Doc side: counts of query terms, query-bigram presence, distinct terms
+    d_counts = np.zeros((n_docs, len(vocab)))
+    d_bigrams = np.zeros((n_docs, len(bigram_vocab)))
+    d_set_size = np.zeros(n_docs)
+    vocab_bits = _token_bits(vocab)
+    for i, (toks, counts) in enumerate(zip(doc_tokens, doc_counts)):
+        d_set_size[i] = len(counts)
+        if doc_bits is not None and doc_bits[i] is not None \
+                and not doc_bits[i] & vocab_bits:
+            continue  # no query term in this doc; every feature is 0
+        for tok, col in vocab.items():
+            tf = counts.get(tok, 0)
+            if tf:
+                d_counts[i, col] = tf
+        if bigram_vocab:
+            for bigram in zip(toks[:-1], toks[1:]):
+                col = bigram_vocab.get(bigram)
+                if col is not None:
+                    d_bigrams[i, col] = 1
+
+    q_presence = (q_counts > 0).astype(np.float64)
+    q_len = q_counts.sum(axis=1)
+    q_set_size = q_presence.sum(axis=1)
+    q_bigram_size = q_bigrams.sum(axis=1)
+    d_presence = (d_counts > 0).astype(np.float64)
 
     # 1. Basic token overlap (Jaccard)
-    intersection = q_token_set.intersection(t_token_set)
-    jaccard = len(intersection) / max(len(q_token_set.union(t_token_set)), 1)
-
-    # 2. BM25-inspired term frequency scoring
-    # Penalize very common terms, boost rare exact matches
-    tf_scores = []
-    for q_term in q_tokens:
-        if q_term in t_tokens:
-            tf = t_tokens.count(q_term)
-            # BM25-like saturation: tf / (tf + k1)
-            k1 = 1.5
-            tf_score = (tf * (k1 + 1)) / (tf + k1)
-            tf_scores.append(tf_score)
-
-    avg_tf_score = sum(tf_scores) / max(len(q_tokens), 1) if tf_scores else 0.0
+    intersection = d_presence @ q_presence.T
+    union = d_set_size[:, None] + q_set_size[None, :] - intersection
+    jaccard = intersection / np.maximum(union, 1)
+
+    # 2. BM25-inspired term frequency scoring, saturated as tf(k1+1)/(tf+k1)
+    k1 = 1.5
+    tf_saturated = d_counts * (k1 + 1) / (d_counts + k1)
+    avg_tf_score = (tf_saturated @ q_counts.T) / np.maximum(q_len, 1)[None, :]
 
     # 3. Phrase/bigram matching (important for multi-word terms)
-    bigram_score = 0.0
-    if len(q_tokens) >= 2:
-        q_bigrams = set(zip(q_tokens[:-1], q_tokens[1:]))
-        t_bigrams = set(zip(t_tokens[:-1], t_tokens[1:]))
-        if q_bigrams and t_bigrams:
-            bigram_matches = len(q_bigrams.intersection(t_bigrams))
-            bigram_score = bigram_matches / len(q_bigrams)
-
-    # 4. Fuzzy sequence similarity (catches minor variations)
-    seq_ratio = difflib.SequenceMatcher(
-        None, normalize_text(query), normalize_text(text)).ratio()
+    bigram_score = (d_bigrams @ q_bigrams.T) / np.maximum(q_bigram_size, 1)[None, :]
+
+    # 4. Fuzzy sequence similarity (token-level LCS ratio); skipped when
+    # under 10% of query terms appear in the text
+    seq_ratio = np.zeros((n_docs, n_queries))
+    for i, j in zip(*np.nonzero(intersection >= 0.1 * q_set_size[None, :])):
+        if intersection[i, j]:
+            t_toks, q_toks = doc_tokens[i], q_tokens[j]
+            seq_ratio[i, j] = 2.0 * _lcs_tokens(q_toks, t_toks) / \
+                (len(q_toks) + len(t_toks))
 
     # 5. Query coverage (what % of query terms found)
-    query_coverage = len(intersection) / max(len(q_token_set), 1)
+    query_coverage = intersection / np.maximum(q_set_size, 1)[None, :]
 
     # Weighted combination favoring exact matches and phrases
     combined = (
@@ -90,7 +246,76 @@ def calculate_lexical_score(query: str, text: str) -> float:
         0.15 * seq_ratio           # Fuzzy matching
     )
 
-    return min(combined, 1.0)
+    # Empty query or empty text scores 0
+    combined[d_set_size == 0, :] = 0.0
+    combined[:, q_set_size == 0] = 0.0
+    return np.minimum(combined, 1.0)
+
+
+def _count_hint_hits(hints: List[str], texts: List[str]) -> np.ndarray:
+    """Number of hints (with repeats) that occur as substrings of each text.
+
+    With pyahocorasick, all hints are matched in one pass over each text
+    instead of one substring search per hint.
+    """
+    if not _AHOCORASICK_AVAILABLE:
+        return np.array([
+            sum(1 for hint in hints if hint in text) for text in texts
+        ], dtype=np.float64)
+
+    multiplicity = Counter(hints)
+    always = multiplicity.pop("", 0)  # "" is a substring of every text
+    if not multiplicity:
+        return np.full(len(texts), float(always))
+
+    automaton = ahocorasick.Automaton()
+    for hint, count in multiplicity.items():
+        automaton.add_word(hint, (hint, count))
+    automaton.make_automaton()
+
+    hits = np.empty(len(texts))
+    for i, text in enumerate(texts):
+        matched = {value for _, value in automaton.iter(text)}
+        hits[i] = always + sum(count for _, count in matched)
+    return hits
+
+
+def _pruning_threshold(
+    lower_bounds: np.ndarray,
+    doc_ids: List[str],
+    n_results: int,
+    max_per_doc: int
+) -> float:
+    """Score a candidate must be able to reach to make the diverse top n.
+
+    Walks candidates by lower bound with the same per-document cap as the
+    diversity rerank; the n-th pick's lower bound is the threshold. Any
+    candidate whose upper bound is below it ranks after n picks that the
+    rerank takes first, so it can never be returned. Returns -inf when
+    fewer than n picks exist (nothing can be pruned).
+    """
+    picks = 0
+    per_doc: Dict[str, int] = {}
+    for i in np.argsort(-lower_bounds, kind='stable'):
+        count = per_doc.get(doc_ids[i], 0)
+        if count < max_per_doc:
+            per_doc[doc_ids[i]] = count + 1
+            picks += 1
+            if picks >= n_results:
+                return float(lower_bounds[i])
+    return float('-inf')
+
+
+@functools.lru_cache(maxsize=4096)
+def _synonyms_for(tok: str) -> Tuple[str, ...]:
+    """Normalized WordNet lemma names for a token, in synset order."""
+    syns = []
+    for syn in wn.synsets(tok):
+        for l in syn.lemmas():
+            syn_word = normalize_text(l.name().replace("_", " "))
+            if syn_word and syn_word not in syns:
+                syns.append(syn_word)
+    return tuple(syns)
 
 
 def generate_query_variants(query: str) -> List[str]:
@@ -104,9 +329,7 @@ def generate_query_variants(query: str) -> List[str]:
     """
     base = normalize_text(query)
     tokens = tokenize(query)
-    fillers = {"the", "a", "an", "that", "this", "these",
-               "those", "was", "is", "are", "be", "been", "just"}
-    without_fillers = " ".join([t for t in tokens if t not in fillers])
+    without_fillers = " ".join([t for t in tokens if t not in _FILLERS])
 
     variants = [base]
     if without_fillers and without_fillers != base:
@@ -116,23 +339,23 @@ def generate_query_variants(query: str) -> List[str]:
         variants.append(" ".join(tokens))
         variants.append("".join(tokens))
 
-    # optional: attempt to use WordNet synonyms if nltk is present
-    try:
-        from nltk.corpus import wordnet as wn
-
-        syns = set()
-        for tok in tokens:
-            for syn in wn.synsets(tok):
-                for l in syn.lemmas():
-                    syn_word = normalize_text(l.name().replace("_", " "))
-                    if syn_word and syn_word not in tokens:
-                        syns.add(syn_word)
-
-        if syns:
-            variants.extend(list(syns)[:6])
-    except Exception:
-        # nltk/wordnet not available — that's fine
-        pass
+    # optional: WordNet synonyms if nltk is present (capped at 6)
+    if _WN_AVAILABLE:
+        token_set = set(tokens)
+        syns = []
+        try:
+            for tok in tokens:
+                for syn_word in _synonyms_for(tok):
+                    if syn_word not in token_set and syn_word not in syns:
+                        syns.append(syn_word)
+                        if len(syns) >= 6:
+                            break
+                if len(syns) >= 6:
+                    break
+        except Exception as e:
+            logger.debug(f"WordNet synonym lookup failed: {e}")
+
+        variants.extend(syns)
 
     # dedupe while preserving order
     seen = set()
@@ -145,7 +368,72 @@ def generate_query_variants(query: str) -> List[str]:
     return out
 
 
-def llm_expand_query(query: str) -> Dict[str, Any]:
+# Terms that mark a query as being about the insurance/medical domain
+_DOMAIN_KEYWORDS = frozenset({
+    "insurance", "insured", "insurer", "policy", "policyholder", "premium",
+    "deductible", "copay", "coinsurance", "claim", "claims", "reimbursement",
+    "coverage", "covered", "cover", "benefit", "benefits", "exclusion",
+    "exclusions", "excluded", "limitation", "waiting", "existing", "hospital",
+    "hospitalization", "treatment", "surgery", "maternity", "accident",
+    "baby", "newborn", "child", "dependent",
+})
+
+
+# Basic domain synonyms for the fallback expansion, as (term, synonyms) pairs
+_DOMAIN_SYNONYMS = (
+    ("baby", ("newborn", "infant", "neonate", "new born baby")),
+    ("child", ("minor", "dependent", "kid", "pediatric")),
+    ("coverage", ("benefit", "protection", "insurance", "policy coverage")),
+    ("excluded", ("not covered", "limitation", "restriction", "does not apply")),
+    ("treatment", ("medical care", "procedure", "therapy", "medical service")),
+    ("accident", ("accidental injury", "bodily injury", "external injury")),
+    ("claim", ("reimbursement", "payment request", "insurance claim")),
+    ("pre-existing", ("prior condition", "existing condition", "previous illness")),
+)
+
+
+def _has_domain_keyword(query: str) -> bool:
+    """True if the query mentions any insurance/medical domain term."""
+    return not _DOMAIN_KEYWORDS.isdisjoint(tokenize(query))
+
+
+def _fallback_expansion(query: str) -> Dict[str, Any]:
+    """Rule-based query expansion used when the LLM is skipped or fails."""
+    expanded_terms = tokenize(query)
+    query_lower = query.lower()
+    for term, synonyms in _DOMAIN_SYNONYMS:
+        if term in query_lower:
+            expanded_terms.extend(synonyms)
+
+    return {
+        "query_type": "general",
+        "semantic_variants": [query],
+        "key_concepts": expanded_terms[:12],
+        "exclusion_terms": ["not covered", "excluded", "limitation"],
+        "hypothetical_answers": [query],
+        "context_hints": ["Coverage", "Benefits", "Exclusions"]
+    }
+
+
+# Shared Groq client so expansion calls reuse one HTTP connection pool
+_GROQ_CLIENT: Optional[AsyncGroq] = None
+_GROQ_CLIENT_LOCK = threading.Lock()
+
+
+def _get_groq_client() -> AsyncGroq:
+    """Return the shared AsyncGroq client, creating it on first use."""
+    global _GROQ_CLIENT
+    if _GROQ_CLIENT is None:
+        with _GROQ_CLIENT_LOCK:
+            if _GROQ_CLIENT is None:
+                _GROQ_CLIENT = AsyncGroq(api_key=settings.GROQ_API_KEY)
+    return _GROQ_CLIENT
+
+
+async def llm_expand_query(
+    query: str,
+    query_embedding: Optional[np.ndarray] = None
+) -> Dict[str, Any]:
     """
     Use LLM to intelligently expand the query with:
     1. Semantic variations with domain synonyms
@@ -155,9 +443,23 @@ def llm_expand_query(query: str) -> Dict[str, Any]:
     5. Question type classification
 
     This dramatically improves retrieval accuracy by understanding user intent.
+    Uses the async Groq client so it can run concurrently with retrieval.
+
+    Short queries with no domain terms skip the LLM entirely. When the
+    normalized query embedding is passed, expansions of near-identical
+    earlier queries are served from the expansion cache.
     """
+    if len(tokenize(query)) < 4 and not _has_domain_keyword(query):
+        return _fallback_expansion(query)
+
+    if query_embedding is not None:
+        cached = _EXPANSION_CACHE.get(query_embedding)
+        if cached is not None:
+            logger.info("LLM query expansion served from cache")
+            return cached
+
     try:
-        client = Groq(api_key=settings.GROQ_API_KEY)
+        client = _get_groq_client()
 
         expansion_prompt = f"""You are an expert search query analyzer for document RAG systems, specializing in insurance, medical, and technical documents.
 
@@ -193,7 +495,7 @@ Focus on insurance/medical terminology, coverage language, and policy structure.
 
 IMPORTANT: Return ONLY valid JSON, no markdown or explanation:"""
 
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[
                 {
@@ -210,42 +512,281 @@ IMPORTANT: Return ONLY valid JSON, no markdown or explanation:"""
             response_format={"type": "json_object"}
         )
 
-        import json
-        expansion = json.loads(response.choices[0].message.content)
+        expansion = orjson.loads(response.choices[0].message.content)
         logger.info(
             f"LLM query expansion: type={expansion.get('query_type')}, "
             f"{len(expansion.get('semantic_variants', []))} variants, "
             f"{len(expansion.get('key_concepts', []))} concepts")
-        return expansion
 
     except Exception as e:
         logger.warning(f"LLM query expansion failed, using fallback: {e}")
-        # Enhanced fallback with basic domain synonyms
-        domain_synonyms = {
-            "baby": ["newborn", "infant", "neonate", "new born baby"],
-            "child": ["minor", "dependent", "kid", "pediatric"],
-            "coverage": ["benefit", "protection", "insurance", "policy coverage"],
-            "excluded": ["not covered", "limitation", "restriction", "does not apply"],
-            "treatment": ["medical care", "procedure", "therapy", "medical service"],
-            "accident": ["accidental injury", "bodily injury", "external injury"],
-            "claim": ["reimbursement", "payment request", "insurance claim"],
-            "pre-existing": ["prior condition", "existing condition", "previous illness"]
-        }
+        return _fallback_expansion(query)
 
-        expanded_terms = tokenize(query)
-        query_lower = query.lower()
-        for term, synonyms in domain_synonyms.items():
-            if term in query_lower:
-                expanded_terms.extend(synonyms)
-
-        return {
-            "query_type": "general",
-            "semantic_variants": [query],
-            "key_concepts": expanded_terms[:12],
-            "exclusion_terms": ["not covered", "excluded", "limitation"],
-            "hypothetical_answers": [query],
-            "context_hints": ["Coverage", "Benefits", "Exclusions"]
-        }
+    if query_embedding is not None:
+        _EXPANSION_CACHE.put(query_embedding, expansion)
+        await asyncio.to_thread(_EXPANSION_CACHE.persist, query_embedding, expansion)
+    return expansion
+
+
+async def _cancel_pending(*tasks: Optional[asyncio.Task]):
+    """Cancel the unfinished tasks among tasks and wait for them to settle."""
+    pending = [task for task in tasks if task is not None and not task.done()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _quantize_embedding(embedding: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Compress an embedding to settings.EMBEDDING_PRECISION for in-memory caching.
+
+    Returns (codes, scale) with embedding ~= codes * scale. int8 uses a
+    per-vector scale so the full code range covers the largest component.
+    """
+    precision = settings.EMBEDDING_PRECISION
+    if precision == "int8":
+        scale = float(np.abs(embedding).max()) / 127.0 or 1.0
+        return np.round(embedding / scale).astype(np.int8), scale
+    if precision == "float16":
+        return embedding.astype(np.float16), 1.0
+    return embedding.astype(np.float32), 1.0
+
+
+def _dequantize_embedding(codes: np.ndarray, scale: float) -> np.ndarray:
+    """Inverse of _quantize_embedding, re-normalized to unit length."""
+    embedding = codes.astype(np.float32) * scale
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else embedding
+
+
+class _QueryEmbedCache:
+    """Thread-safe LRU of query text -> normalized query embedding."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry is None:
+                return None
+            self._entries.move_to_end(text)
+        return _dequantize_embedding(*entry)
+
+    def put(self, text: str, embedding: np.ndarray):
+        entry = _quantize_embedding(embedding)
+        with self._lock:
+            self._entries[text] = entry
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+_EMPTY_SLOT = object()  # _SemanticCache slot holding no entry
+
+
+class _SemanticCache:
+    """
+    Thread-safe TTL cache keyed by normalized embedding plus an exact key.
+
+    A lookup hits when an unexpired entry with the same key has cosine
+    similarity >= threshold with the probe embedding. Entries live in a
+    preallocated ring buffer (oldest overwritten first): the embedding
+    matrix is updated row by row and a lookup is one matrix-vector product
+    over it, with no per-lookup copies.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, threshold: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # Allocated on the first put, once the embedding size is known
+        self._matrix: Optional[np.ndarray] = None
+        self._scales = np.ones(maxsize, dtype=np.float32)
+        self._expires = np.full(maxsize, -np.inf)
+        # Exact keys are mapped to small ints so matching them is vectorized
+        self._key_ids = np.full(maxsize, -1, dtype=np.int64)
+        self._key_index: Dict[Any, int] = {}
+        self._next_key_id = 0
+        self._slot_keys: List[Any] = [_EMPTY_SLOT] * maxsize
+        self._values: List[Any] = [None] * maxsize
+        self._next = 0
+        self._size = 0
+
+    def get(self, embedding: np.ndarray, key: Any = None) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            key_id = self._key_index.get(key)
+            if key_id is None or self._matrix is None:
+                return None
+            n = self._size
+            live = (self._key_ids[:n] == key_id) & (self._expires[:n] > now)
+            if not live.any():
+                return None
+            sims = (self._matrix[:n] @ embedding) * self._scales[:n]
+            sims[~live] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                return self._values[best]
+            return None
+
+    def put(self, embedding: np.ndarray, value: Any, key: Any = None):
+        codes, scale = _quantize_embedding(embedding)
+        with self._lock:
+            self._store_locked(codes, scale, value, key, time.monotonic() + self.ttl)
+
+    def _store_locked(self, codes: np.ndarray, scale: float, value: Any, key: Any, expires_at: float):
+        """Write an entry over the oldest slot. Caller must hold _lock."""
+        if self._matrix is None:
+            self._matrix = np.zeros((self.maxsize, codes.shape[0]), dtype=codes.dtype)
+
+        slot = self._next
+        self._slot_keys[slot] = _EMPTY_SLOT  # its old key no longer counts as in use
+        key_id = self._key_index.get(key)
+        if key_id is None:
+            if len(self._key_index) >= self.maxsize:
+                self._compact_keys_locked()
+            key_id = self._key_index[key] = self._next_key_id
+            self._next_key_id += 1
+
+        self._matrix[slot] = codes
+        self._scales[slot] = scale
+        self._expires[slot] = expires_at
+        self._key_ids[slot] = key_id
+        self._slot_keys[slot] = key
+        self._values[slot] = value
+        self._next = (slot + 1) % self.maxsize
+        self._size = max(self._size, slot + 1)
+
+    def _compact_keys_locked(self):
+        """Renumber keys, dropping those no slot uses any more."""
+        self._key_index = {}
+        for slot in range(self._size):
+            key = self._slot_keys[slot]
+            if key is _EMPTY_SLOT:
+                self._key_ids[slot] = -1
+                continue
+            self._key_ids[slot] = self._key_index.setdefault(key, len(self._key_index))
+        self._next_key_id = len(self._key_index)
+
+    def clear(self):
+        with self._lock:
+            self._key_ids.fill(-1)
+            self._expires.fill(-np.inf)
+            self._key_index = {}
+            self._next_key_id = 0
+            self._slot_keys = [_EMPTY_SLOT] * self.maxsize
+            self._values = [None] * self.maxsize
+            self._next = 0
+            self._size = 0
+
+
+class _ExpansionCache(_SemanticCache):
+    """
+    _SemanticCache of LLM query expansions, persisted as JSON lines.
+
+    persist() appends each new expansion to the file, so expansions survive
+    restarts and workers started later pick up what earlier ones cached.
+    Expiry is stored as wall-clock time. The file is shared by all uvicorn
+    workers, so writes take an flock on a sidecar lock file; it is compacted
+    to the newest maxsize live entries on load() and whenever it grows past
+    twice that.
+    """
+
+    def __init__(self, path: str, maxsize: int, ttl: float, threshold: float):
+        super().__init__(maxsize, ttl, threshold)
+        self.path = path
+
+    @contextmanager
+    def _file_lock(self):
+        """Hold an exclusive lock on the cache file across processes and threads."""
+        with open(f"{self.path}.lock", "ab") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield  # closing the file releases the lock
+
+    def _read_live(self) -> List[Dict[str, Any]]:
+        """Unexpired records in the file, oldest first. Caller holds the file lock."""
+        now_wall = time.time()
+        live = []
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # partially written line
+                if record["expires_at"] > now_wall:
+                    live.append(record)
+        return live[-self.maxsize:]
+
+    def _rewrite(self, records: List[Dict[str, Any]]):
+        """Replace the file with records. Caller holds the file lock."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            for record in records:
+                f.write(orjson.dumps(record) + b"\n")
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with self._file_lock():
+                live = self._read_live()
+                # Rewrite the file without expired/evicted entries
+                self._rewrite(live)
+        except OSError as e:
+            logger.warning(f"Could not load query expansion cache: {e}")
+            return
+
+        now_wall, now_mono = time.time(), time.monotonic()
+        self.clear()
+        with self._lock:
+            for record in live:
+                codes, scale = _quantize_embedding(
+                    np.asarray(record["embedding"], dtype=np.float32))
+                self._store_locked(
+                    codes, scale, record["expansion"], None,
+                    now_mono + record["expires_at"] - now_wall)
+
+        logger.info(f"Loaded {len(live)} cached query expansions")
+
+    def persist(self, embedding: np.ndarray, value: Any):
+        """Append an expansion to the file (blocking I/O; run off the event loop)."""
+        line = orjson.dumps(
+            {
+                "embedding": embedding,
+                "expansion": value,
+                "expires_at": time.time() + self.ttl
+            },
+            option=orjson.OPT_SERIALIZE_NUMPY
+        ) + b"\n"
+        try:
+            with self._file_lock():
+                with open(self.path, "ab") as f:
+                    f.write(line)
+                    size = f.tell()
+                # Lines are all about one embedding in size, so the file
+                # size tracks the line count without re-reading it
+                if size > 2 * self.maxsize * len(line):
+                    self._rewrite(self._read_live())
+        except OSError as e:
+            logger.warning(f"Could not persist query expansion: {e}")
+
+
+_EXPANSION_CACHE = _ExpansionCache(
+    os.path.join(settings.CHROMA_PERSIST_DIR, "query_expansion_cache.jsonl"),
+    maxsize=settings.EXPANSION_CACHE_SIZE,
+    ttl=settings.EXPANSION_CACHE_TTL,
+    threshold=settings.QUERY_CACHE_SIMILARITY
+)
+
+
+# Fields of a Chroma query result used by search and reranking
+_RESULT_FIELDS = ("ids", "documents", "metadatas", "distances")
 
 
 class ChromaDB:
@@ -255,6 +796,40 @@ class ChromaDB:
     collection = None
     embedding_model = None
 
+    # In-memory chunk ID index so per-user lookups avoid a metadata where-scan.
+    # _indexed_count is the collection count the index is known to match;
+    # a mismatch means another worker wrote to Chroma and the index is rebuilt.
+    # Searches don't use it: Chroma's filtered query already handles scopes
+    # smaller than n_results.
+    _user_chunk_ids: Dict[str, Set[str]] = {}
+    _doc_chunk_ids: Dict[str, Set[str]] = {}
+    _doc_owner: Dict[str, str] = {}
+    _indexed_count = 0
+    _index_lock = threading.Lock()
+    _rebuild_lock = threading.Lock()  # One rebuild at a time; waiters reuse it
+
+    # Document listings by (user_id, limit), stored with the data version
+    # (see _data_version) they were built at so writes from other workers
+    # invalidate them too
+    _user_docs_cache: "TTLCache[Tuple[str, Optional[int]], Tuple[Tuple[str, int], List[Dict[str, Any]]]]" = TTLCache(
+        maxsize=settings.USER_DOCS_CACHE_SIZE, ttl=settings.USER_DOCS_CACHE_TTL)
+    _user_docs_lock = threading.Lock()
+
+    # (monotonic timestamp, count) for get_collection_count; a zero timestamp
+    # forces a refresh. Index staleness checks call collection.count() directly.
+    _count_cache: Tuple[float, int] = (0.0, 0)
+    _count_lock = threading.Lock()
+
+    # Query embeddings by exact text, and Chroma query results by
+    # (near-)identical embedding and data version; local writes also drop
+    # the cached results
+    _query_embeddings = _QueryEmbedCache(settings.QUERY_EMBEDDING_CACHE_SIZE)
+    _query_results = _SemanticCache(
+        maxsize=settings.QUERY_RESULT_CACHE_SIZE,
+        ttl=settings.QUERY_RESULT_CACHE_TTL,
+        threshold=settings.QUERY_CACHE_SIMILARITY
+    )
+
     @classmethod
     def initialize(cls):
         """Initialize ChromaDB client and embedding model."""
@@ -264,38 +839,222 @@ class ChromaDB:
                 settings=ChromaSettings(anonymized_telemetry=False)
             )
 
+            # HNSW parameters only take effect when the collection is created
             cls.collection = cls.client.get_or_create_collection(
                 name="documents",
-                metadata={"hnsw:space": "cosine"}
+                metadata={
+                    "hnsw:space": "cosine",
+                    "hnsw:M": settings.CHROMA_HNSW_M,
+                    "hnsw:construction_ef": settings.CHROMA_HNSW_CONSTRUCTION_EF,
+                    "hnsw:search_ef": settings.CHROMA_HNSW_SEARCH_EF
+                }
             )
 
             # Initialize embedding model with optimized settings
-            import torch
+            # One intra-op thread per physical core (logical count / 2);
+            # oversubscribing hyperthreads slows CPU inference
+            torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+            try:
+                torch.set_num_interop_threads(2)
+            except RuntimeError:
+                # Only settable once, before any inter-op parallel work has run
+                pass
             
-            # Use all available CPU cores for faster encoding
-            torch.set_num_threads(torch.get_num_threads())  # Ensure multi-threading is enabled
-            
-            cls.embedding_model = SentenceTransformer(
-                settings.EMBEDDING_MODEL,
-                device=settings.EMBEDDING_DEVICE
-            )
+            cls.embedding_model = cls._load_embedding_model()
             
             # Enable additional optimizations
             cls.embedding_model.eval()  # Set to evaluation mode (faster inference)
             if settings.EMBEDDING_DEVICE == 'cpu':
                 # Optimize for CPU inference
-                import os
                 os.environ['OMP_NUM_THREADS'] = str(torch.get_num_threads())
                 os.environ['MKL_NUM_THREADS'] = str(torch.get_num_threads())
 
+            cls._rebuild_chunk_index()
+            _EXPANSION_CACHE.load()
+
+            # Compile the scoring kernel now so the first search doesn't pay JIT latency
+            warmup_reranker()
+
             logger.info(
-                f"ChromaDB initialized with {cls.collection.count()} embeddings (using {torch.get_num_threads()} CPU threads)"
+                f"ChromaDB initialized with {cls.get_collection().count()} embeddings (using {torch.get_num_threads()} CPU threads)"
             )
 
         except Exception as e:
             logger.error(f"Failed to initialize ChromaDB: {e}")
             raise
 
+    @classmethod
+    def _load_embedding_model(cls) -> SentenceTransformer:
+        """
+        Load the embedding model for settings.EMBEDDING_BACKEND.
+
+        "torch" runs the model with PyTorch on EMBEDDING_DEVICE. "onnx-int8"
+        runs a dynamically quantized (AVX512-VNNI) ONNX export on the CPU
+        through ONNX Runtime; the export is built once and cached under
+        EMBEDDING_ONNX_DIR. Both expose the same encode() interface.
+
+        The ONNX backend needs the extra packages in requirements-onnx.txt.
+        """
+        if settings.EMBEDDING_BACKEND != "onnx-int8":
+            return SentenceTransformer(
+                settings.EMBEDDING_MODEL,
+                device=settings.EMBEDDING_DEVICE
+            )
+
+        export_dir = os.path.join(
+            settings.EMBEDDING_ONNX_DIR,
+            settings.EMBEDDING_MODEL.replace("/", "__")
+        )
+        onnx_file = "onnx/model_qint8_avx512_vnni.onnx"
+        if not os.path.exists(os.path.join(export_dir, onnx_file)):
+            os.makedirs(settings.EMBEDDING_ONNX_DIR, exist_ok=True)
+            # Every uvicorn worker starts here at once: one exports under the
+            # lock while the others wait, then find the finished export
+            with open(f"{export_dir}.lock", "ab") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if not os.path.exists(os.path.join(export_dir, onnx_file)):
+                    cls._export_onnx_model(export_dir, onnx_file)
+
+        return SentenceTransformer(
+            export_dir,
+            device="cpu",
+            backend="onnx",
+            model_kwargs={
+                "file_name": onnx_file,
+                "provider": "CPUExecutionProvider"
+            }
+        )
+
+    @staticmethod
+    def _export_onnx_model(export_dir: str, onnx_file: str):
+        """
+        Export EMBEDDING_MODEL to a quantized ONNX model in export_dir.
+
+        The export is written to a temporary directory and moved into place
+        with os.replace, so export_dir never holds a half-written model.
+        """
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        logger.info(
+            f"Exporting {settings.EMBEDDING_MODEL} to INT8 ONNX in {export_dir}")
+        tmp_dir = f"{export_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        model = SentenceTransformer(
+            settings.EMBEDDING_MODEL, device="cpu", backend="onnx")
+        model.save(tmp_dir)
+        export_dynamic_quantized_onnx_model(model, "avx512_vnni", tmp_dir)
+
+        # Clear a stale export that lacks the quantized model
+        shutil.rmtree(export_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, export_dir)
+        except OSError:
+            # Without flock another process may have finished first
+            if not os.path.exists(os.path.join(export_dir, onnx_file)):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def _rebuild_chunk_index(cls):
+        """Populate the user/doc -> chunk ID index from the collection."""
+        collection = cls.get_collection()
+        count = collection.count()
+
+        # Only user_id and doc_id are needed, so read just those keys from
+        # sqlite rather than every chunk's full metadata (token streams etc.)
+        projected = cls._projected_metadata_from_sqlite(("user_id", "doc_id"))
+        if projected is None:
+            results = collection.get(include=["metadatas"])
+            projected = (results['ids'], results['metadatas'])
+        ids, metadatas = projected
+
+        with cls._index_lock:
+            cls._user_chunk_ids = {}
+            cls._doc_chunk_ids = {}
+            cls._doc_owner = {}
+            cls._index_chunks_locked(ids, metadatas)
+            cls._indexed_count = count
+
+        # The collection changed under us, so cached query results may be stale
+        cls._query_results.clear()
+
+        logger.info(
+            f"Indexed {len(ids)} chunks for {len(cls._user_chunk_ids)} users")
+
+    @classmethod
+    def _index_chunks_locked(cls, ids: List[str], metadatas: List[Dict[str, Any]]):
+        """Add chunk IDs to the index. Caller must hold _index_lock."""
+        for chunk_id, metadata in zip(ids, metadatas):
+            metadata = metadata or {}
+            user_id = metadata.get('user_id')
+            doc_id = metadata.get('doc_id')
+            if user_id:
+                cls._user_chunk_ids.setdefault(user_id, set()).add(chunk_id)
+            if doc_id:
+                cls._doc_chunk_ids.setdefault(doc_id, set()).add(chunk_id)
+                if user_id:
+                    cls._doc_owner[doc_id] = user_id
+
+    @classmethod
+    def _get_indexed_chunk_ids(
+        cls,
+        user_id: str,
+        doc_id: Optional[str] = None
+    ) -> List[str]:
+        """
+        Get chunk IDs for a user (optionally narrowed to one document).
+
+        Rebuilds the index first if the collection was modified outside this
+        process (e.g. by another uvicorn worker).
+        """
+        if cls.get_collection().count() != cls._indexed_count:
+            with cls._rebuild_lock:
+                # Another thread may have rebuilt while we waited
+                if cls.get_collection().count() != cls._indexed_count:
+                    cls._rebuild_chunk_index()
+
+        with cls._index_lock:
+            user_ids = cls._user_chunk_ids.get(user_id, set())
+            if doc_id is None:
+                return list(user_ids)
+            return list(user_ids & cls._doc_chunk_ids.get(doc_id, set()))
+
+    @classmethod
+    def _encode(cls, texts: List[str], **kwargs) -> np.ndarray:
+        """
+        Encode texts with the embedding model under torch.inference_mode.
+
+        SentenceTransformer.encode only disables gradients; inference_mode
+        also skips version counting and view tracking on every tensor.
+        """
+        with torch.inference_mode():
+            return cls.embedding_model.encode(texts, **kwargs)
+
+    @classmethod
+    def _embed_queries(cls, query_texts: List[str]) -> np.ndarray:
+        """
+        Normalized (K, D) query embeddings. Texts in the exact-text cache are
+        reused; the rest are encoded together in a single forward pass.
+        """
+        embeddings = [cls._query_embeddings.get(text) for text in query_texts]
+        missing = [text for text, emb in zip(query_texts, embeddings) if emb is None]
+
+        if missing:
+            encoded = iter(cls._encode(
+                missing,
+                batch_size=len(missing),
+                show_progress_bar=False,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            ))
+            for k, text in enumerate(query_texts):
+                if embeddings[k] is None:
+                    embeddings[k] = next(encoded)
+                    cls._query_embeddings.put(text, embeddings[k])
+
+        return np.stack(embeddings)
+
     @classmethod
     def add_documents(
         cls,
@@ -313,51 +1072,91 @@ class ChromaDB:
             ids: List of unique IDs for chunks
         """
         try:
-            import time
             start_time = time.time()
             
             logger.info(f"Starting embedding generation for {len(texts)} chunks...")
-            
-            # Generate embeddings with optimized settings
-            # - batch_size: Process in optimal batches for better throughput
-            # - normalize_embeddings: True for better similarity scoring (no quality loss)
-            # - show_progress_bar: False to avoid overhead
-            # - convert_to_numpy: True to get numpy arrays, then convert to list
-            embeddings = cls.embedding_model.encode(
-                texts,
-                batch_size=32,  # Optimal batch size for multi-qa-mpnet-base-dot-v1
-                show_progress_bar=False,
-                normalize_embeddings=True,  # Better for cosine similarity
-                convert_to_numpy=True  # Get numpy array first
-            )
-            
-            # Convert numpy array to list
-            embeddings = embeddings.tolist()
-            
-            embedding_time = time.time() - start_time
-            logger.info(f"Generated {len(embeddings)} embeddings in {embedding_time:.2f}s ({len(embeddings)/embedding_time:.1f} chunks/sec)")
 
-            # Add to ChromaDB in batches to avoid memory issues with large documents
-            batch_size = 100
+            # Store each chunk's normalized token stream so reranking doesn't
+            # re-tokenize candidate text on every query, its token bitset
+            # (hex) for the lexical scorer's overlap prefilter and the
+            # lowercased filename for metadata matching
+            metadatas = [
+                {
+                    **metadata,
+                    "_tokens": " ".join(tokens),
+                    "_tok_bits": format(_token_bits(tokens), "x"),
+                    "_filename_lower": metadata.get("filename", "").lower()
+                }
+                for tokens, metadata in zip(map(tokenize, texts), metadatas)
+            ]
+
+            # Encode and add in batches: each batch is handed to the Chroma
+            # insert pool as soon as it is encoded, so inserts overlap with
+            # encoding the next batch. At most CHROMA_ADD_WORKERS batches are
+            # in flight (encoding waits for a slot), which bounds how many
+            # batches' embeddings are held in memory. Chroma's HNSW insert
+            # releases the GIL.
+            collection = cls.get_collection()
+            batch_size = settings.CHROMA_ADD_BATCH_SIZE
+            max_in_flight = settings.CHROMA_ADD_WORKERS
             total_added = 0
-            
-            for i in range(0, len(texts), batch_size):
-                batch_end = min(i + batch_size, len(texts))
-                batch_embeddings = embeddings[i:batch_end]
-                batch_texts = texts[i:batch_end]
-                batch_metadatas = metadatas[i:batch_end]
-                batch_ids = ids[i:batch_end]
-                
-                cls.collection.add(
-                    embeddings=batch_embeddings,
-                    documents=batch_texts,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids
-                )
-                
-                total_added += len(batch_texts)
-                if len(texts) > batch_size:
-                    logger.info(f"Added batch {i//batch_size + 1}: {total_added}/{len(texts)} chunks")
+            embedding_time = 0.0
+            in_flight = {}
+
+            def collect(done):
+                nonlocal total_added
+                for future in done:
+                    future.result()
+                    total_added += in_flight.pop(future)
+                    if len(texts) > batch_size:
+                        logger.info(f"Added batch: {total_added}/{len(texts)} chunks")
+
+            try:
+                with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+                    for i in range(0, len(texts), batch_size):
+                        if len(in_flight) >= max_in_flight:
+                            collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+
+                        encode_start = time.time()
+                        # Generate embeddings with optimized settings
+                        # - batch_size: Process in optimal batches for better throughput
+                        # - normalize_embeddings: True for better similarity scoring (no quality loss)
+                        # - show_progress_bar: False to avoid overhead
+                        # - convert_to_numpy: True to get a float32 array; Chroma accepts
+                        #   ndarrays directly, so no per-float Python objects are created
+                        batch_embeddings = cls._encode(
+                            texts[i:i + batch_size],
+                            batch_size=32,  # Optimal batch size for multi-qa-mpnet-base-dot-v1
+                            show_progress_bar=False,
+                            normalize_embeddings=True,  # Better for cosine similarity
+                            convert_to_numpy=True
+                        )
+                        embedding_time += time.time() - encode_start
+
+                        future = executor.submit(
+                            collection.add,
+                            embeddings=batch_embeddings,
+                            documents=texts[i:i + batch_size],
+                            metadatas=metadatas[i:i + batch_size],
+                            ids=ids[i:i + batch_size]
+                        )
+                        in_flight[future] = len(batch_embeddings)
+
+                    collect(wait(in_flight).done)
+            except Exception:
+                # The executor has drained in-flight adds by now; remove every
+                # batch of this upload that did land so it is all-or-nothing
+                cls._rollback_add(collection, ids)
+                raise
+
+            logger.info(f"Generated {len(texts)} embeddings in {embedding_time:.2f}s ({len(texts)/max(embedding_time, 1e-9):.1f} chunks/sec)")
+
+            with cls._index_lock:
+                cls._index_chunks_locked(ids, metadatas)
+                cls._indexed_count += len(ids)
+            cls._query_results.clear()
+            cls._invalidate_user_docs({m.get("user_id") for m in metadatas})
+            cls._invalidate_count()
 
             total_time = time.time() - start_time
             logger.info(f"Successfully added {len(texts)} documents to ChromaDB in {total_time:.2f}s total")
@@ -366,6 +1165,18 @@ class ChromaDB:
             logger.error(f"Failed to add documents: {e}")
             raise
 
+    @classmethod
+    def _rollback_add(cls, collection, ids: List[str]):
+        """Delete the chunks of a failed add_documents call (best effort)."""
+        try:
+            cls._delete_ids_in_batches(collection, ids)
+        except Exception as e:
+            logger.error(f"Failed to roll back partially added chunks: {e}")
+        # Searches during the upload may have cached the removed chunks
+        cls._query_results.clear()
+        cls._invalidate_count()
+        logger.warning(f"Rolled back {len(ids)} chunks after a failed add")
+
     @classmethod
     def _normalize_filter(cls, filter_dict: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
         """
@@ -400,31 +1211,268 @@ class ChromaDB:
         filter_dict: Optional[Dict[str, Any]] = None,
         use_expansion: bool = True
     ) -> Dict[str, Any]:
+        # For now we keep the original query for embedding.
+        # Query variants and lexical reranking are applied in search_with_reranking.
+        return cls.search_multi([query_text], n_results=n_results, filter_dict=filter_dict)
+
+    @classmethod
+    def search_multi(
+        cls,
+        query_texts: List[str],
+        n_results: int = 5,
+        filter_dict: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Search with several query texts using one batched encode and one
+        Chroma query with a (K, D) embedding matrix.
+
+        Each row is cached on its own, so only rows without a (near-)identical
+        recent query on the same scope are sent to Chroma.
+
+        Returns Chroma's multi-row result format: row k of each field holds
+        the matches for query_texts[k].
+        """
         try:
-            # For now we keep the original query for embedding.
-            # Query variants and lexical reranking are applied in search_with_reranking.
-            query_embedding = cls.embedding_model.encode(
-                [query_text],
-                show_progress_bar=False
-            ).tolist()
+            query_embeddings = cls._embed_queries(query_texts)
 
             # Normalize filter to ChromaDB's expected format
             normalized_filter = cls._normalize_filter(filter_dict)
 
-            results = cls.collection.query(
-                query_embeddings=query_embedding,
-                n_results=n_results,
-                where=normalized_filter
+            # Reuse results of (near-)identical recent queries on the same
+            # scope and the same collection data; the data version makes
+            # writes from other workers miss the cache too
+            cache_key = (
+                cls._data_version(),
+                orjson.dumps(normalized_filter, option=orjson.OPT_SORT_KEYS),
+                n_results
             )
+            rows = [cls._query_results.get(embedding, cache_key)
+                    for embedding in query_embeddings]
+            missing = [k for k, row in enumerate(rows) if row is None]
+            if missing:
+                results = cls.get_collection().query(
+                    query_embeddings=query_embeddings[missing],
+                    n_results=n_results,
+                    where=normalized_filter
+                )
+                for r, k in enumerate(missing):
+                    rows[k] = {field: [results[field][r]] for field in _RESULT_FIELDS}
+                    cls._query_results.put(query_embeddings[k], rows[k], cache_key)
 
-            return results
+            if len(rows) == 1:
+                return rows[0]
+            return {field: [row[field][0] for row in rows] for field in _RESULT_FIELDS}
 
         except Exception as e:
             logger.error(f"Search failed: {e}")
             raise
 
     @classmethod
-    def search_with_reranking(
+    def _rerank_candidates(
+        cls,
+        query_text: str,
+        expansion: Dict[str, Any],
+        n_results: int,
+        flat_ids: List[str],
+        flat_distances: List[float],
+        flat_docs: List[str],
+        flat_metas: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Deduplicate retrieved rows, score them with the hybrid reranker and
+        return the diverse top n_results in Chroma's query result layout.
+        """
+        # Map every retrieved row to its candidate row
+        candidate_rows: Dict[str, int] = {}
+        row_index = np.fromiter(
+            (candidate_rows.setdefault(chunk_id, len(candidate_rows))
+             for chunk_id in flat_ids),
+            dtype=np.intp, count=len(flat_ids))
+        n_candidates = len(candidate_rows)
+        # Candidate rows are numbered in order of first sighting
+        _, first_seen = np.unique(row_index, return_index=True)
+
+        candidate_ids = [flat_ids[k] for k in first_seen]
+        candidate_docs = [flat_docs[k] for k in first_seen]
+        candidate_metas = [flat_metas[k] for k in first_seen]
+        # Keep the distance from the first query that found the chunk
+        # (the original query wins when it retrieved it)
+        distances = np.asarray(flat_distances, dtype=np.float64)[first_seen]
+        n_matches = np.bincount(row_index, minlength=n_candidates)
+
+        # Step 3: Advanced multi-signal hybrid scoring
+        key_concepts = set(expansion.get('key_concepts', []))
+        exclusion_terms = set(expansion.get('exclusion_terms', []))
+        context_hints = [h.lower()
+                         for h in expansion.get('context_hints', [])]
+        query_type = expansion.get('query_type', 'general')
+        hypothetical_answers = expansion.get('hypothetical_answers', [])
+
+        candidate_tokens = [
+            metadata['_tokens'].split() if '_tokens' in metadata
+            else tokenize(doc)
+            for doc, metadata in zip(candidate_docs, candidate_metas)
+        ]
+        # Term frequencies per candidate, shared by lexical and term-hit scoring
+        candidate_counts = [Counter(toks) for toks in candidate_tokens]
+        candidate_bits = [
+            int(metadata['_tok_bits'], 16) if '_tok_bits' in metadata else None
+            for metadata in candidate_metas
+        ]
+        # Query-side lexical features, prepared once for all candidates
+        all_variants = [_prepare_lexical_query(q) for q in
+                        [query_text] + expansion.get('semantic_variants', [])[:4]]
+        hyde_queries = [_prepare_lexical_query(q) for q in hypothetical_answers[:2]]
+
+        # Key concept coverage and exclusion term detection: one
+        # candidates x terms presence matrix over both term sets (terms in
+        # both are looked up once), then per-set column sums
+        hit_terms = list(key_concepts | exclusion_terms)
+        presence = np.array(
+            [[term in counts for term in hit_terms] for counts in candidate_counts],
+            dtype=np.float64).reshape(n_candidates, len(hit_terms))
+        concept_hits = presence @ np.array(
+            [term in key_concepts for term in hit_terms], dtype=np.float64)
+        exclusion_hits = presence @ np.array(
+            [term in exclusion_terms for term in hit_terms], dtype=np.float64)
+
+        # Context hint matching (section titles, headers)
+        context_hits = _count_hint_hits(
+            context_hints, [doc.lower() for doc in candidate_docs]) \
+            if context_hints else np.zeros(n_candidates)
+
+        lengths = np.fromiter(
+            map(len, candidate_docs), dtype=np.float64, count=n_candidates)
+
+        # Metadata relevance (e.g., filename matching query terms)
+        filename_terms = all_variants[0].tokens[:3]
+        metadata_scores = np.fromiter(
+            (0.5 if any(term in filename for term in filename_terms) else 0.0
+             for filename in (
+                 metadata.get('_filename_lower')
+                 or metadata.get('filename', '').lower()
+                 for metadata in candidate_metas)),
+            dtype=np.float64, count=n_candidates)
+
+        # Boost exclusion matches if the query is about exclusions
+        query_lower = query_text.lower()
+        exclusion_boost = 2.0 if (
+            query_type == 'exclusion' or 'not covered' in query_lower
+            or 'excluded' in query_lower) else 1.0
+
+        type_id = query_type_id(query_type)
+        keyword_scores = np.zeros(n_candidates)
+        hyde_scores = np.zeros(n_candidates)
+
+        def score_all():
+            # Adaptive weighted combination based on query type
+            return score_candidates(
+                distances,
+                concept_hits, len(key_concepts),
+                exclusion_hits, len(exclusion_terms),
+                context_hits, len(context_hints),
+                lengths,
+                n_matches,
+                type_id,
+                keyword_scores,
+                hyde_scores,
+                metadata_scores,
+                exclusion_boost=exclusion_boost
+            )
+
+        # Upper-bound pruning: score every candidate without the lexical
+        # signals (a lower bound), bound the best it could reach with
+        # them, and skip lexical scoring for candidates that cannot make
+        # the diverse top n_results
+        max_per_doc = max(2, n_results // 3)  # Max 2-3 chunks per document
+        candidate_doc_ids = [m.get('doc_id', 'unknown') for m in candidate_metas]
+        lower_bounds, _ = score_all()
+        slack = feature_weight(type_id, 'lexical')
+        if hyde_queries:
+            slack += feature_weight(type_id, 'hyde')
+        upper_bounds = np.minimum(lower_bounds + slack, 1.0)
+        threshold = _pruning_threshold(
+            lower_bounds, candidate_doc_ids, n_results, max_per_doc)
+        keep = np.flatnonzero(upper_bounds >= threshold)
+
+        # Lexical scores for surviving candidates against query + variants
+        # (keyword score) and hypothetical answers (HyDE) in one batch
+        lexical_matrix = _batch_lexical_scores(
+            all_variants + hyde_queries,
+            [candidate_docs[i] for i in keep],
+            [candidate_tokens[i] for i in keep],
+            [candidate_counts[i] for i in keep],
+            [candidate_bits[i] for i in keep])
+        keyword_scores[keep] = lexical_matrix[:, :len(all_variants)].max(axis=1)
+        if hyde_queries:
+            hyde_scores[keep] = lexical_matrix[:, len(all_variants):].max(axis=1)
+
+        scores, features = score_all()
+
+        scored_results = []
+        for i in keep[np.argsort(-scores[keep], kind='stable')]:
+            scored_results.append({
+                'score': float(scores[i]),
+                'document': candidate_docs[i],
+                'metadata': candidate_metas[i],
+                'id': candidate_ids[i],
+                'distance': float(distances[i]),
+                'debug': {
+                    name: round(float(value), 3)
+                    for name, value in zip(SCORE_FEATURES, features[i])
+                }
+            })
+
+        # Step 4: Apply diversity-aware reranking (scored_results is sorted)
+        # Ensure chunk diversity (avoid too many similar chunks from same document)
+        diverse_results = []
+        doc_chunk_count = {}
+
+        for result in scored_results:
+            doc_id = result['metadata'].get('doc_id', 'unknown')
+            count = doc_chunk_count.get(doc_id, 0)
+
+            if count < max_per_doc:
+                diverse_results.append(result)
+                doc_chunk_count[doc_id] = count + 1
+
+            if len(diverse_results) >= n_results:
+                break
+
+        # If diversity filtering was too aggressive, add more from top scores
+        if len(diverse_results) < n_results:
+            for result in scored_results:
+                if result not in diverse_results:
+                    diverse_results.append(result)
+                    if len(diverse_results) >= n_results:
+                        break
+
+        top_results = diverse_results[:n_results]
+
+        reranked = {
+            'documents': [[r['document'] for r in top_results]],
+            'metadatas': [[r['metadata'] for r in top_results]],
+            'ids': [[r['id'] for r in top_results]],
+            'distances': [[r['distance'] for r in top_results]]
+        }
+
+        # Log detailed scoring breakdown for top result
+        if top_results:
+            top = top_results[0]
+            logger.info(
+                f"Enhanced retrieval: {n_candidates} candidates → {len(top_results)} diverse results\n"
+                f"Query type: {query_type} | Top score: {top['score']:.3f}\n"
+                f"Score breakdown: sem={top['debug']['semantic']:.3f}, "
+                f"lex={top['debug']['lexical']:.3f}, hyde={top['debug']['hyde']:.3f}, "
+                f"concept={top['debug']['concepts']:.3f}, excl={top['debug']['exclusions']:.3f}, "
+                f"ctx={top['debug']['context']:.3f}\n"
+                f"Concepts found: {len(key_concepts)}, Exclusion terms: {len(exclusion_terms)}, "
+                f"Context hints: {len(context_hints)}"
+            )
+        return reranked
+
+    @classmethod
+    async def search_with_reranking(
         cls,
         query_text: str,
         n_results: int = 5,
@@ -436,383 +1484,541 @@ class ChromaDB:
         Enhanced search with LLM-powered query understanding and multi-strategy retrieval.
 
         Strategy:
-        1. Use LLM to expand query into semantic variants + key concepts
+        1. Use LLM to expand query into semantic variants + key concepts,
+           unless the original-query search already matches strongly
         2. Retrieve more candidates using multiple query versions
         3. Apply hybrid scoring (semantic + lexical + LLM relevance)
         4. Return top results after intelligent reranking
         """
         try:
-            # Step 1: LLM-powered query expansion
-            expansion = llm_expand_query(query_text) if use_llm_expansion else {
+            # Step 1: original-query search (overlapping the query embedding),
+            # then LLM-powered query expansion if it's still needed
+            initial_task = asyncio.create_task(asyncio.to_thread(
+                cls.search,
+                query_text,
+                n_results=retrieve_count,
+                filter_dict=filter_dict
+            ))
+            expansion_task = None
+
+            basic_expansion = {
                 "semantic_variants": [query_text],
                 "key_concepts": tokenize(query_text),
                 "exclusion_terms": [],
                 "hypothetical_answer": ""
             }
 
-            # Step 2: Multi-query retrieval - search with original + variants
-            all_candidates = {}  # Use dict to deduplicate by chunk ID
-
-            # Search with original query
-            initial_results = cls.search(
-                query_text,
-                n_results=retrieve_count,
-                filter_dict=filter_dict
-            )
-
-            if initial_results['documents'][0]:
-                for i, chunk_id in enumerate(initial_results['ids'][0]):
-                    if chunk_id not in all_candidates:
-                        all_candidates[chunk_id] = {
-                            'document': initial_results['documents'][0][i],
-                            'metadata': initial_results['metadatas'][0][i],
-                            'id': chunk_id,
-                            'distance': initial_results['distances'][0][i],
-                            'query_matches': [query_text]
-                        }
+            try:
+                if use_llm_expansion:
+                    # The embedding keys the expansion cache; search() reuses it
+                    # from the query embedding cache
+                    query_embedding = await asyncio.to_thread(
+                        cls._embed_queries, [query_text])
+                    if settings.EXPANSION_OVERLAP_SEARCH:
+                        expansion_task = asyncio.create_task(
+                            llm_expand_query(query_text, query_embedding[0]))
+                    initial_results = await initial_task
+
+                    # Skip expansion (and the variant/HyDE searches) when the
+                    # original query already has a strong semantic match;
+                    # unless overlapping, the LLM is only called after this
+                    top_similarity = 0.0
+                    if initial_results['distances'] and initial_results['distances'][0]:
+                        top_similarity = 1.0 - initial_results['distances'][0][0]
+
+                    if top_similarity >= settings.EXPANSION_SKIP_SIMILARITY:
+                        expansion = basic_expansion
+                        logger.info(
+                            f"Skipping LLM expansion: top similarity {top_similarity:.3f} "
+                            f">= {settings.EXPANSION_SKIP_SIMILARITY}")
+                    elif expansion_task is not None:
+                        expansion = await expansion_task
                     else:
-                        all_candidates[chunk_id]['query_matches'].append(
-                            query_text)
+                        expansion = await llm_expand_query(query_text, query_embedding[0])
+                else:
+                    expansion = basic_expansion
+                    initial_results = await initial_task
+            finally:
+                # Don't leave either task running (or unawaited) on errors
+                # or when the expansion is skipped
+                await _cancel_pending(initial_task, expansion_task)
+
+            # Step 2: Multi-query retrieval - search with original + variants.
+            # Result rows from all queries are flattened, then deduplicated by
+            # chunk ID into one candidate table (parallel lists + arrays).
+            flat_ids, flat_distances, flat_docs, flat_metas = [], [], [], []
+
+            def collect_results(results: Dict[str, Any], row: int):
+                flat_ids.extend(results['ids'][row])
+                flat_distances.extend(results['distances'][row])
+                flat_docs.extend(results['documents'][row])
+                flat_metas.extend(results['metadatas'][row])
+
+            collect_results(initial_results, 0)
+
+            # Search with semantic variants (top 3) and the hypothetical
+            # answer (HyDE technique) in one batched encode + Chroma query
+            extra_queries = []
+            for variant in expansion.get('semantic_variants', [])[:3]:
+                if variant.lower() != query_text.lower():
+                    extra_queries.append(variant)
 
-            # Search with semantic variants
-            for variant in expansion.get('semantic_variants', [])[:3]:  # Limit to top 3
-                if variant.lower() == query_text.lower():
-                    continue
+            hyde_text = expansion.get('hypothetical_answer', '')
+            if hyde_text and len(hyde_text) > 20:
+                extra_queries.append(hyde_text)
 
+            if extra_queries:
                 try:
-                    variant_results = cls.search(
-                        variant,
+                    extra_results = await asyncio.to_thread(
+                        cls.search_multi,
+                        extra_queries,
                         n_results=retrieve_count // 2,  # Fewer results per variant
                         filter_dict=filter_dict
                     )
-
-                    if variant_results['documents'][0]:
-                        for i, chunk_id in enumerate(variant_results['ids'][0]):
-                            if chunk_id not in all_candidates:
-                                all_candidates[chunk_id] = {
-                                    'document': variant_results['documents'][0][i],
-                                    'metadata': variant_results['metadatas'][0][i],
-                                    'id': chunk_id,
-                                    'distance': variant_results['distances'][0][i],
-                                    'query_matches': [variant]
-                                }
-                            else:
-                                all_candidates[chunk_id]['query_matches'].append(
-                                    variant)
+                    for row in range(len(extra_queries)):
+                        collect_results(extra_results, row)
                 except Exception as e:
-                    logger.warning(
-                        f"Variant search failed for '{variant}': {e}")
+                    logger.warning(f"Variant/HyDE search failed: {e}")
 
-            # Search with hypothetical answer (HyDE technique)
-            hyde_text = expansion.get('hypothetical_answer', '')
-            if hyde_text and len(hyde_text) > 20:
-                try:
-                    hyde_results = cls.search(
-                        hyde_text,
-                        n_results=retrieve_count // 2,
-                        filter_dict=filter_dict
-                    )
+            if not flat_ids:
+                return initial_results
 
-                    if hyde_results['documents'][0]:
-                        for i, chunk_id in enumerate(hyde_results['ids'][0]):
-                            if chunk_id not in all_candidates:
-                                all_candidates[chunk_id] = {
-                                    'document': hyde_results['documents'][0][i],
-                                    'metadata': hyde_results['metadatas'][0][i],
-                                    'id': chunk_id,
-                                    'distance': hyde_results['distances'][0][i],
-                                    'query_matches': ['[HyDE]']
-                                }
-                            else:
-                                all_candidates[chunk_id]['query_matches'].append(
-                                    '[HyDE]')
-                except Exception as e:
-                    logger.warning(f"HyDE search failed: {e}")
+            # Scoring and reranking are CPU-bound; keep them off the event loop
+            return await asyncio.to_thread(
+                cls._rerank_candidates,
+                query_text, expansion, n_results,
+                flat_ids, flat_distances, flat_docs, flat_metas
+            )
 
-            if not all_candidates:
-                return initial_results
+        except Exception as e:
+            logger.error(
+                f"Enhanced search failed, falling back to basic search: {e}")
+            # Fallback to basic search
+            return await asyncio.to_thread(
+                cls.search, query_text, n_results=n_results, filter_dict=filter_dict)
 
-            # Step 3: Advanced multi-signal hybrid scoring
-            key_concepts = set(expansion.get('key_concepts', []))
-            exclusion_terms = set(expansion.get('exclusion_terms', []))
-            context_hints = [h.lower()
-                             for h in expansion.get('context_hints', [])]
-            query_type = expansion.get('query_type', 'general')
-            hypothetical_answers = expansion.get('hypothetical_answers', [])
-
-            scored_results = []
-            for chunk_id, candidate in all_candidates.items():
-                doc = candidate['document']
-                metadata = candidate['metadata']
-                distance = candidate['distance']
-
-                # 1. Semantic similarity score (from embedding distance)
-                semantic_score = 1.0 - min(distance, 1.0)
-
-                # 2. Enhanced lexical matching with query + variants + hypotheticals
-                all_variants = [query_text] + \
-                    expansion.get('semantic_variants', [])[:4]
-                lexical_scores = [calculate_lexical_score(
-                    v, doc) for v in all_variants]
-                keyword_score = max(lexical_scores) if lexical_scores else 0.0
-
-                # 3. Hypothetical answer similarity (HyDE)
-                hyde_score = 0.0
-                if hypothetical_answers:
-                    hyde_scores = [calculate_lexical_score(
-                        hyp, doc) for hyp in hypothetical_answers[:2]]
-                    hyde_score = max(hyde_scores) if hyde_scores else 0.0
-
-                # 4. Key concept coverage with weighted importance
-                doc_tokens = set(tokenize(doc))
-                concept_matches = key_concepts.intersection(doc_tokens)
-                # Weight by how early concepts appear in query (earlier = more important)
-                concept_score = len(
-                    concept_matches) / max(len(key_concepts), 1) if key_concepts else 0.0
-
-                # 5. Exclusion term detection (critical for insurance queries)
-                exclusion_matches = exclusion_terms.intersection(doc_tokens)
-                exclusion_score = len(
-                    exclusion_matches) / max(len(exclusion_terms), 1) if exclusion_terms else 0.0
-                # Boost if query is about exclusions
-                if query_type == 'exclusion' or 'not covered' in query_text.lower() or 'excluded' in query_text.lower():
-                    exclusion_score *= 2.0
-
-                # 6. Context hint matching (section titles, headers)
-                context_score = 0.0
-                if context_hints:
-                    chunk_text_lower = doc.lower()
-                    matching_hints = sum(
-                        1 for hint in context_hints if hint in chunk_text_lower)
-                    context_score = matching_hints / max(len(context_hints), 1)
-
-                # 7. Multi-query match confidence
-                multi_match_bonus = min(
-                    len(candidate['query_matches']) * 0.05, 0.2)
-
-                # 8. Document length penalty (very short chunks might be incomplete)
-                # Normalize to 500 chars
-                length_score = min(len(doc) / 500.0, 1.0)
-
-                # 9. Metadata relevance (e.g., filename matching query terms)
-                metadata_score = 0.0
-                filename = metadata.get('filename', '').lower()
-                if any(term in filename for term in tokenize(query_text)[:3]):
-                    metadata_score = 0.5
-
-                # Adaptive weighted combination based on query type
-                if query_type == 'definition':
-                    # For definitions, prioritize semantic + concept coverage
-                    combined_score = (
-                        0.40 * semantic_score +
-                        0.25 * concept_score +
-                        0.15 * keyword_score +
-                        0.10 * hyde_score +
-                        0.05 * context_score +
-                        0.05 * multi_match_bonus
-                    )
-                elif query_type == 'exclusion':
-                    # For exclusions, heavily weight exclusion terms
-                    combined_score = (
-                        0.30 * semantic_score +
-                        0.30 * exclusion_score +
-                        0.20 * keyword_score +
-                        0.10 * context_score +
-                        0.10 * multi_match_bonus
-                    )
-                elif query_type == 'coverage':
-                    # For coverage, balance semantic + lexical + concepts
-                    combined_score = (
-                        0.35 * semantic_score +
-                        0.25 * keyword_score +
-                        0.15 * concept_score +
-                        0.10 * hyde_score +
-                        0.10 * context_score +
-                        0.05 * multi_match_bonus
-                    )
-                else:
-                    # General balanced scoring
-                    combined_score = (
-                        0.35 * semantic_score +
-                        0.20 * keyword_score +
-                        0.15 * concept_score +
-                        0.10 * hyde_score +
-                        0.08 * exclusion_score +
-                        0.07 * context_score +
-                        0.03 * length_score +
-                        0.02 * metadata_score
-                    )
+    @classmethod
+    def get_collection(cls):
+        """Get the Chroma collection handle."""
+        if cls.collection is None:
+            raise Exception("ChromaDB not initialized")
+        return cls.collection
 
-                # Add multi-match bonus universally
-                combined_score += multi_match_bonus * 0.1
-
-                scored_results.append({
-                    'score': min(combined_score, 1.0),
-                    'document': doc,
-                    'metadata': candidate['metadata'],
-                    'id': chunk_id,
-                    'distance': distance,
-                    'debug': {
-                        'semantic': round(semantic_score, 3),
-                        'lexical': round(keyword_score, 3),
-                        'hyde': round(hyde_score, 3),
-                        'concepts': round(concept_score, 3),
-                        'exclusions': round(exclusion_score, 3),
-                        'context': round(context_score, 3),
-                        'multi_match': round(multi_match_bonus, 3),
-                        'length': round(length_score, 3),
-                        'metadata': round(metadata_score, 3)
-                    }
-                })
-
-            # Step 4: Sort and apply diversity-aware reranking
-            scored_results.sort(key=lambda x: x['score'], reverse=True)
-
-            # Ensure chunk diversity (avoid too many similar chunks from same document)
-            diverse_results = []
-            doc_chunk_count = {}
-            max_per_doc = max(2, n_results // 3)  # Max 2-3 chunks per document
+    @classmethod
+    def get_collection_count(cls) -> int:
+        """Get the total number of embeddings in the collection (cached briefly)."""
+        with cls._count_lock:
+            timestamp, count = cls._count_cache
+            if time.monotonic() - timestamp < settings.COLLECTION_COUNT_CACHE_TTL:
+                return count
+            count = cls.get_collection().count()
+            cls._count_cache = (time.monotonic(), count)
+            return count
 
-            for result in scored_results:
-                doc_id = result['metadata'].get('doc_id', 'unknown')
-                count = doc_chunk_count.get(doc_id, 0)
+    @classmethod
+    def _invalidate_count(cls):
+        """Force the next get_collection_count to query Chroma."""
+        with cls._count_lock:
+            cls._count_cache = (0.0, 0)
+
+    # One row per document for a user, aggregated from Chroma's metadata segment
+    _USER_DOCUMENTS_SQL = """
+        SELECT d.string_value, MIN(f.string_value), MAX(u.string_value), COUNT(*)
+        FROM segments s
+        JOIN embeddings e ON e.segment_id = s.id
+        JOIN embedding_metadata o
+            ON o.id = e.id AND o.key = 'user_id' AND o.string_value = ?
+        JOIN embedding_metadata d ON d.id = e.id AND d.key = 'doc_id'
+        LEFT JOIN embedding_metadata f ON f.id = e.id AND f.key = 'filename'
+        LEFT JOIN embedding_metadata u ON u.id = e.id AND u.key = 'upload_date'
+        WHERE s.collection = ? AND s.scope = 'METADATA'
+        GROUP BY d.string_value
+        ORDER BY MAX(u.string_value) DESC
+        LIMIT ?
+    """
 
-                if count < max_per_doc:
-                    diverse_results.append(result)
-                    doc_chunk_count[doc_id] = count + 1
+    @classmethod
+    def ensure_metadata_index(cls):
+        """
+        Make sure Chroma's sqlite store has an index on
+        embedding_metadata(key, string_value), so user_id / doc_id filters
+        are index seeks. Chroma ships this index from 0.5.x on; stores
+        created by older versions get it here (plus ANALYZE). Idempotent.
+        """
+        db_path = os.path.join(settings.CHROMA_PERSIST_DIR, "chroma.sqlite3")
+        if not os.path.exists(db_path):
+            logger.info("Chroma sqlite store not found; skipping metadata index check")
+            return
 
-                if len(diverse_results) >= n_results:
-                    break
+        try:
+            conn = sqlite3.connect(db_path, timeout=30)
+            try:
+                for _, name, *_ in conn.execute("PRAGMA index_list('embedding_metadata')").fetchall():
+                    columns = [row[2] for row in conn.execute(f"PRAGMA index_info('{name}')")]
+                    if columns[:2] == ["key", "string_value"]:
+                        logger.info(f"Chroma metadata index present: {name}")
+                        return
+
+                start_time = time.time()
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS embedding_metadata_key_string_value "
+                    "ON embedding_metadata (key, string_value)"
+                )
+                conn.execute("ANALYZE embedding_metadata")
+                conn.commit()
+                logger.info(f"Created Chroma metadata index on (key, string_value) in {time.time() - start_time:.2f}s")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not check Chroma metadata index: {e}")
+
+    @staticmethod
+    def _query_chroma_sqlite(sql: str, params: Tuple) -> Optional[List[Tuple]]:
+        """
+        Run a read-only query against Chroma's sqlite store. Returns None if
+        the store can't be read, e.g. when Chroma runs as a separate server.
+        """
+        db_path = os.path.join(settings.CHROMA_PERSIST_DIR, "chroma.sqlite3")
+        if not os.path.exists(db_path):
+            return None
 
-            # If diversity filtering was too aggressive, add more from top scores
-            if len(diverse_results) < n_results:
-                for result in scored_results:
-                    if result not in diverse_results:
-                        diverse_results.append(result)
-                        if len(diverse_results) >= n_results:
-                            break
+        try:
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            try:
+                conn.execute("PRAGMA query_only = 1")
+                return conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("Query on Chroma's sqlite store failed: {}", e)
+            return None
+
+    # Sequence number of the last write applied to a collection's metadata
+    # segment (stored as an 8-byte big-endian blob by Chroma 0.5.x)
+    _DATA_VERSION_SQL = """
+        SELECT m.seq_id
+        FROM max_seq_id m
+        JOIN segments s ON s.id = m.segment_id
+        WHERE s.collection = ? AND s.scope = 'METADATA'
+    """
+
+    @classmethod
+    def _data_version(cls) -> Tuple[str, int]:
+        """
+        A value that changes on every write to the collection from any
+        process, unlike the count (a delete plus an add of as many chunks
+        leaves it unchanged). Falls back to the count if the store can't
+        be read or nothing was written yet.
+        """
+        rows = cls._query_chroma_sqlite(
+            cls._DATA_VERSION_SQL, (str(cls.get_collection().id),))
+        if rows:
+            seq_id = rows[0][0]
+            if isinstance(seq_id, bytes):
+                seq_id = int.from_bytes(seq_id, "big")
+            return ("seq", int(seq_id))
+        return ("count", cls.get_collection().count())
+
+    # Selected metadata keys of every chunk in a collection, one row per key
+    _PROJECTED_METADATA_SQL = """
+        SELECT e.embedding_id, m.key, m.string_value
+        FROM segments s
+        JOIN embeddings e ON e.segment_id = s.id
+        JOIN embedding_metadata m ON m.id = e.id AND m.key IN ({keys})
+        WHERE s.collection = ? AND s.scope = 'METADATA'
+    """
 
-            top_results = diverse_results[:n_results]
+    @classmethod
+    def _projected_metadata_from_sqlite(
+        cls,
+        keys: Tuple[str, ...]
+    ) -> Optional[Tuple[List[str], List[Dict[str, Any]]]]:
+        """
+        Read only the given (string) metadata keys of every chunk from
+        Chroma's sqlite store, as (ids, metadatas) like collection.get.
+        Chunks with none of the keys are omitted. Returns None if the store
+        can't be read.
+        """
+        rows = cls._query_chroma_sqlite(
+            cls._PROJECTED_METADATA_SQL.format(keys=", ".join("?" * len(keys))),
+            (*keys, str(cls.get_collection().id))
+        )
+        if rows is None:
+            return None
 
-            reranked = {
-                'documents': [[r['document'] for r in top_results]],
-                'metadatas': [[r['metadata'] for r in top_results]],
-                'ids': [[r['id'] for r in top_results]],
-                'distances': [[r['distance'] for r in top_results]]
+        metadatas: Dict[str, Dict[str, Any]] = {}
+        for chunk_id, key, value in rows:
+            metadatas.setdefault(chunk_id, {})[key] = value
+        return list(metadatas), list(metadatas.values())
+
+    @classmethod
+    def _user_documents_from_sqlite(
+        cls,
+        user_id: str,
+        limit: Optional[int] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """One row per user document from Chroma's sqlite store (None if unreadable)."""
+        rows = cls._query_chroma_sqlite(
+            cls._USER_DOCUMENTS_SQL,
+            # LIMIT -1 means no limit in sqlite
+            (user_id, str(cls.get_collection().id), -1 if limit is None else limit)
+        )
+        if rows is None:
+            return None
+
+        return [
+            {
+                'doc_id': doc_id,
+                'filename': filename if filename is not None else 'Unknown',
+                'upload_date': upload_date,
+                'user_id': user_id,
+                'chunk_count': chunk_count
             }
+            for doc_id, filename, upload_date, chunk_count in rows
+        ]
 
-            # Log detailed scoring breakdown for top result
-            if top_results:
-                top = top_results[0]
-                logger.info(
-                    f"Enhanced retrieval: {len(all_candidates)} candidates → {len(top_results)} diverse results\n"
-                    f"Query type: {query_type} | Top score: {top['score']:.3f}\n"
-                    f"Score breakdown: sem={top['debug']['semantic']:.3f}, "
-                    f"lex={top['debug']['lexical']:.3f}, hyde={top['debug']['hyde']:.3f}, "
-                    f"concept={top['debug']['concepts']:.3f}, excl={top['debug']['exclusions']:.3f}, "
-                    f"ctx={top['debug']['context']:.3f}\n"
-                    f"Concepts found: {len(key_concepts)}, Exclusion terms: {len(exclusion_terms)}, "
-                    f"Context hints: {len(context_hints)}"
-                )
-            return reranked
+    # Above this many chunks, the fallback listing groups projected columns
+    # with numpy instead of building a DataFrame from the metadata dicts
+    _ARRAY_GROUPING_MIN_CHUNKS = 5000
 
-        except Exception as e:
-            logger.error(
-                f"Enhanced search failed, falling back to basic search: {e}")
-            # Fallback to basic search
-            return cls.search(query_text, n_results=n_results, filter_dict=filter_dict)
+    @staticmethod
+    def _group_user_documents(
+        metadatas: List[Dict[str, Any]],
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Same grouping as the DataFrame path in _user_documents_from_chroma,
+        done on factorized codes: one pass projects the four columns, then
+        counts, first rows and latest upload dates are numpy aggregations.
+        """
+        rows = [
+            (m['doc_id'], m.get('filename'), m.get('upload_date'), m.get('user_id'))
+            for m in metadatas if m and m.get('doc_id')
+        ]
+        if not rows:
+            return []
+        doc_ids, filenames, upload_dates, user_ids = (
+            np.asarray(column, dtype=object) for column in zip(*rows))
+
+        # Codes follow first appearance, like groupby(sort=False)
+        doc_codes, doc_uniques = pd.factorize(doc_ids)
+        n_docs = len(doc_uniques)
+        chunk_counts = np.bincount(doc_codes, minlength=n_docs)
+        _, first_rows = np.unique(doc_codes, return_index=True)
+
+        # First non-null user_id per document
+        user_rows = np.full(n_docs, len(rows))
+        has_user = np.flatnonzero(pd.notna(user_ids))
+        np.minimum.at(user_rows, doc_codes[has_user], has_user)
+
+        # ISO dates sort as strings, so the latest date is the max sorted code
+        date_codes, date_uniques = pd.factorize(upload_dates, sort=True)
+        latest = np.full(n_docs, -1)
+        np.maximum.at(latest, doc_codes, date_codes)
+
+        # Newest first, documents without a date last
+        order = np.argsort(-latest, kind='stable')[:limit]
+        return [
+            {
+                'doc_id': doc_uniques[i],
+                'filename': filenames[first_rows[i]] if filenames[first_rows[i]] is not None else 'Unknown',
+                'upload_date': date_uniques[latest[i]] if latest[i] >= 0 else None,
+                'user_id': user_ids[user_rows[i]] if user_rows[i] < len(rows) else None,
+                'chunk_count': int(chunk_counts[i])
+            }
+            for i in order
+        ]
 
     @classmethod
-    def get_collection_count(cls) -> int:
-        """Get the total number of embeddings in the collection."""
-        return cls.collection.count()
+    def _user_documents_from_chroma(
+        cls,
+        user_id: str,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Group a user's chunk metadata fetched through the Chroma API."""
+        # Fetch this user's chunks by ID from the in-memory index
+        chunk_ids = cls._get_indexed_chunk_ids(user_id)
+        if not chunk_ids:
+            return []
+
+        results = cls.get_collection().get(
+            ids=chunk_ids,
+            include=["metadatas"]
+        )
+
+        if not results or not results['metadatas']:
+            return []
+
+        if len(results['metadatas']) > cls._ARRAY_GROUPING_MIN_CHUNKS:
+            return cls._group_user_documents(results['metadatas'], limit)
+
+        # Group chunks by doc_id (chunks without one are skipped)
+        df = pd.DataFrame(
+            results['metadatas'],
+            columns=['doc_id', 'filename', 'upload_date', 'user_id']
+        )
+        df = df[df['doc_id'].notna() & (df['doc_id'] != '')]
+        if df.empty:
+            return []
+        df['filename'] = df['filename'].fillna('Unknown')
+
+        documents = (
+            df.groupby('doc_id', sort=False)
+            .agg(
+                filename=('filename', 'first'),
+                upload_date=('upload_date', 'max'),
+                user_id=('user_id', 'first'),
+                chunk_count=('doc_id', 'size')
+            )
+            # Newest first
+            .sort_values('upload_date', ascending=False, kind='stable')
+            .head(limit)
+            .reset_index()
+        )
+        documents = documents.astype(object).where(documents.notna(), None)
+        return [
+            {**record, 'chunk_count': int(record['chunk_count'])}
+            for record in documents.to_dict(orient='records')
+        ]
 
     @classmethod
-    def get_user_documents(cls, user_id: str) -> List[Dict[str, Any]]:
+    def get_user_documents(
+        cls,
+        user_id: str,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """
-        Get all documents for a specific user.
+        Get all documents for a specific user, newest first.
 
         Args:
             user_id: The user ID to filter by
+            limit: Return only the most recent `limit` documents (all if None)
 
         Returns:
             List of documents with metadata
         """
         try:
-            # Query all documents for this user (single condition, no normalization needed)
-            results = cls.collection.get(
-                where={"user_id": user_id},
-                include=["metadatas"]
-            )
+            version = cls._data_version()
+            with cls._user_docs_lock:
+                cached = cls._user_docs_cache.get((user_id, limit))
+            if cached is not None and cached[0] == version:
+                return cached[1]
 
-            if not results or not results['metadatas']:
-                return []
-
-            # Group chunks by doc_id
-            docs_dict = {}
-            for metadata in results['metadatas']:
-                doc_id = metadata.get('doc_id')
-                if doc_id and doc_id not in docs_dict:
-                    docs_dict[doc_id] = {
-                        'doc_id': doc_id,
-                        'filename': metadata.get('filename', 'Unknown'),
-                        'upload_date': metadata.get('upload_date'),
-                        'user_id': metadata.get('user_id'),
-                        'chunk_count': 0
-                    }
-
-                if doc_id:
-                    docs_dict[doc_id]['chunk_count'] += 1
-
-            # Convert to list and sort by upload date (newest first)
-            documents = list(docs_dict.values())
-            documents.sort(
-                key=lambda x: x.get('upload_date', ''),
-                reverse=True
-            )
+            documents = cls._user_documents_from_sqlite(user_id, limit)
+            if documents is None:
+                documents = cls._user_documents_from_chroma(user_id, limit)
 
-            logger.info(
-                f"Retrieved {len(documents)} documents for user {user_id}")
+            with cls._user_docs_lock:
+                cls._user_docs_cache[(user_id, limit)] = (version, documents)
+
+            logger.info("Retrieved {} documents for user {}", len(documents), user_id)
             return documents
 
         except Exception as e:
-            logger.error(f"Failed to get user documents: {e}")
+            logger.error("Failed to get user documents: {}", e)
             return []
 
     @classmethod
-    def delete_by_doc_id(cls, doc_id: str):
+    def _invalidate_user_docs(cls, user_ids=None):
+        """Drop cached document listings for user_ids (all users if None)."""
+        with cls._user_docs_lock:
+            if user_ids is None:
+                cls._user_docs_cache.clear()
+            else:
+                user_ids = set(user_ids)
+                for key in [key for key in cls._user_docs_cache if key[0] in user_ids]:
+                    cls._user_docs_cache.pop(key, None)
+
+    @classmethod
+    def delete_by_doc_id(cls, doc_id: str, user_id: Optional[str] = None):
         """
         Delete all chunks for a specific document.
 
         Args:
             doc_id: The document ID to delete
+            user_id: Owner of the document (looked up in the chunk index if omitted)
         """
         try:
-            cls.collection.delete(where={"doc_id": doc_id})
-            logger.info(f"Deleted chunks for document: {doc_id}")
+            cls.get_collection().delete(where={"doc_id": doc_id})
+
+            with cls._index_lock:
+                chunk_ids = cls._doc_chunk_ids.pop(doc_id, set())
+                owner = cls._doc_owner.pop(doc_id, None)
+                if owner in cls._user_chunk_ids:
+                    cls._user_chunk_ids[owner] -= chunk_ids
+                cls._indexed_count -= len(chunk_ids)
+            cls._query_results.clear()
+            cls._invalidate_user_docs([user_id or owner])
+            cls._invalidate_count()
+
+            logger.info("Deleted chunks for document: {}", doc_id)
         except Exception as e:
-            logger.error(f"Failed to delete document: {e}")
+            logger.error("Failed to delete document: {}", e)
             raise
 
+    @staticmethod
+    def _delete_ids_in_batches(collection, ids: List[str]) -> int:
+        """
+        Delete chunks by ID in CHROMA_DELETE_BATCH_SIZE slices, keeping each
+        SQL IN-list small. Two workers let the next slice be submitted while
+        the previous delete runs.
+        """
+        batch_size = settings.CHROMA_DELETE_BATCH_SIZE
+        total_deleted = 0
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = {
+                executor.submit(collection.delete, ids=ids[i:i + batch_size]): len(ids[i:i + batch_size])
+                for i in range(0, len(ids), batch_size)
+            }
+            for future in as_completed(futures):
+                future.result()
+                total_deleted += futures[future]
+
+        logger.info("Deleted {} chunks by ID in batches of {}", total_deleted, batch_size)
+        return total_deleted
+
     @classmethod
-    def delete_all_documents(cls):
+    def delete_all_documents(cls, force_ids: bool = False):
         """
         Delete ALL documents and chunks from the collection.
         WARNING: This will clear the entire vector database!
+
+        Chunks are deleted with a match-everything where clause, so no IDs
+        or payloads are pulled into Python. The collection itself is kept:
+        dropping and recreating it would invalidate the collection handle
+        held by every other process (uvicorn workers, this script's caller).
+
+        Args:
+            force_ids: Enumerate all IDs and delete by ID instead (debugging)
         """
         try:
-            # Get all IDs
-            all_data = cls.collection.get()
-            if all_data and all_data['ids']:
-                count = len(all_data['ids'])
-                cls.collection.delete(ids=all_data['ids'])
-                logger.info(f"Deleted all {count} chunks from ChromaDB")
-                return count
-            else:
+            collection = cls.get_collection()
+            count = collection.count()
+            if count == 0:
                 logger.info("No documents to delete")
                 return 0
+
+            if force_ids:
+                cls._delete_ids_in_batches(collection, collection.get(include=[])['ids'])
+            else:
+                collection.delete(where={"user_id": {"$ne": "__never__"}})
+                if collection.count():
+                    # Chunks stored without a user_id; remove them by ID
+                    cls._delete_ids_in_batches(collection, collection.get(include=[])['ids'])
+
+            with cls._index_lock:
+                cls._user_chunk_ids = {}
+                cls._doc_chunk_ids = {}
+                cls._doc_owner = {}
+                cls._indexed_count = 0
+            cls._query_results.clear()
+            cls._invalidate_user_docs()
+            cls._invalidate_count()
+
+            logger.info("Deleted all {} chunks from ChromaDB", count)
+            return count
         except Exception as e:
-            logger.error(f"Failed to delete all documents: {e}")
+            logger.error("Failed to delete all documents: {}", e)
             raise
 
 
@@ -5,7 +5,6 @@ WARNING: This will clear the entire vector database!
 """
 
 from app.services.vector_db import ChromaDB
-from loguru import logger
 
 
 def main():
@@ -16,8 +15,8 @@ def main():
     print("from the ChromaDB vector database.")
     print("="*60 + "\n")
 
-    # Get current count
-    current_count = ChromaDB.get_collection_count()
+    # Get current count (uncached: this decides whether anything is deleted)
+    current_count = ChromaDB.get_collection().count()
     print(f"Current embeddings in database: {current_count}")
 
     if current_count == 0:
@@ -32,7 +31,7 @@ def main():
         deleted_count = ChromaDB.delete_all_documents()
 
         # Verify deletion
-        remaining = ChromaDB.get_collection_count()
+        remaining = ChromaDB.get_collection().count()
 
         print(f"\n✓ Successfully deleted {deleted_count} chunks")
         print(f"✓ Remaining embeddings: {remaining}")
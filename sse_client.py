@@ -0,0 +1,83 @@
+"""
+Shared streaming client helpers for the DocuMind AI test scripts
+(test_query.py, test_accuracy.py).
+"""
+
+import importlib.util
+import sys
+import threading
+from collections import deque
+
+import httpx
+import orjson
+
+# HTTP/2 needs the optional h2 package; otherwise HTTP/1.1 keep-alive is used
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+# SSE frames carry JSON after a "data: " prefix
+DATA_PREFIX = b'data: '
+
+
+async def sse_events(response: httpx.Response):
+    """Yield the JSON payload of each SSE "data:" frame, parsed from raw bytes."""
+    buffer = b""
+    async for chunk in response.aiter_bytes():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if not line.startswith(DATA_PREFIX):
+                continue
+            try:
+                yield orjson.loads(line[len(DATA_PREFIX):])
+            except orjson.JSONDecodeError:
+                continue
+
+
+class TokenPrinter:
+    """
+    Buffers streamed tokens and writes them to stdout in batches from a
+    background thread, so the SSE loop doesn't flush stdout per token.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self._buf = deque()
+        self._lock = threading.Lock()
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+    def write(self, text: str):
+        with self._lock:
+            self._buf.append(text)
+
+    def flush(self):
+        """Write out everything buffered so far."""
+        with self._lock:
+            text = ''.join(self._buf)
+            self._buf.clear()
+            if text:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.flush()
+
+
+def make_client(base_url: str) -> httpx.AsyncClient:
+    """AsyncClient for the API, meant to be shared by every request of a run."""
+    return httpx.AsyncClient(
+        base_url=base_url,
+        http2=HTTP2,
+        timeout=httpx.Timeout(10.0, read=None),  # Streams can idle while the LLM works
+        limits=httpx.Limits(keepalive_expiry=60)
+    )
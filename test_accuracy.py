@@ -3,8 +3,13 @@ Test script to verify the accuracy improvements in DocuMind AI
 Run this after uploading documents to test the enhanced retrieval
 """
 
-import requests
-import json
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from sse_client import TokenPrinter, make_client, sse_events
 
 API_URL = "http://localhost:8000"
 
@@ -38,8 +43,8 @@ test_queries = [
 ]
 
 
-def test_query(token: str, query: str):
-    """Test a single query and show results"""
+async def test_query(client: httpx.AsyncClient, token: str, query: str, echo: bool = True):
+    """Test a single query and show results (streamed live when echo is True)"""
     headers = {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
@@ -47,35 +52,33 @@ def test_query(token: str, query: str):
 
     payload = {"query": query}
 
-    print(f"\n{'='*80}")
-    print(f"QUERY: {query}")
-    print(f"{'='*80}\n")
+    if echo:
+        print(f"\n{'='*80}")
+        print(f"QUERY: {query}")
+        print(f"{'='*80}\n")
 
     try:
-        response = requests.post(
-            f"{API_URL}/api/v1/chat/query",
+        async with client.stream(
+            "POST",
+            "/api/v1/chat/query",
             headers=headers,
-            json=payload,
-            stream=True
-        )
-
-        answer = ""
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith('data: '):
-                    try:
-                        data = json.loads(line_str[6:])
-                        if data['type'] == 'token':
-                            answer += data['content']
-                            print(data['content'], end='', flush=True)
-                        elif data['type'] == 'references':
-                            print(
-                                f"\n[References: {len(data['content'])} chunks retrieved]")
-                    except json.JSONDecodeError:
-                        pass
-
-        print("\n")
+            json=payload
+        ) as response:
+
+            answer = ""
+            with TokenPrinter() as out:
+                async for data in sse_events(response):
+                    if data['type'] == 'token':
+                        answer += data['content']
+                        if echo:
+                            out.write(data['content'])
+                    elif data['type'] == 'references' and echo:
+                        out.flush()
+                        print(
+                            f"\n[References: {len(data['content'])} chunks retrieved]")
+
+        if echo:
+            print("\n")
         return answer
 
     except Exception as e:
@@ -83,7 +86,22 @@ def test_query(token: str, query: str):
         return None
 
 
-def main():
+async def timed_query(client: httpx.AsyncClient, token: str, query: str, echo: bool = True):
+    """Run test_query and return (answer, wall time in seconds)"""
+    start = time.perf_counter()
+    answer = await test_query(client, token, query, echo=echo)
+    return answer, time.perf_counter() - start
+
+
+def report(answer):
+    """Print the pass/fail line for a test answer"""
+    if answer:
+        print(f"\n✓ Test completed ({len(answer)} chars)")
+    else:
+        print(f"\n✗ Test failed")
+
+
+async def amain(parallel: bool = False):
     """Main test function"""
     print("🔍 DocuMind AI - Accuracy Test Suite")
     print("=" * 80)
@@ -105,19 +123,46 @@ def main():
 
     print("\n✅ Token received. Starting tests...\n")
 
-    # Run all test queries
-    for i, test in enumerate(test_queries, 1):
-        print(f"\n📋 Test {i}/{len(test_queries)}: {test['name']}")
-        print(f"Expected: {test['expected']}")
+    timings = []
+    suite_start = time.perf_counter()
+
+    # One client shared by every query so the connection is reused
+    async with make_client(API_URL) as client:
+        if parallel:
+            # All queries stream concurrently; answers are shown at the end
+            results = await asyncio.gather(*[
+                timed_query(client, token, test['query'], echo=False)
+                for test in test_queries
+            ])
+            for i, (test, (answer, elapsed)) in enumerate(zip(test_queries, results), 1):
+                print(f"\n📋 Test {i}/{len(test_queries)}: {test['name']}")
+                print(f"Expected: {test['expected']}")
+                print(f"\n{'='*80}")
+                print(f"QUERY: {test['query']}")
+                print(f"{'='*80}\n")
+                print(answer or "")
+                report(answer)
+                timings.append((test['name'], elapsed))
+        else:
+            # Run all test queries
+            for i, test in enumerate(test_queries, 1):
+                print(f"\n📋 Test {i}/{len(test_queries)}: {test['name']}")
+                print(f"Expected: {test['expected']}")
 
-        answer = test_query(token, test['query'])
+                answer, elapsed = await timed_query(client, token, test['query'])
+                report(answer)
+                timings.append((test['name'], elapsed))
 
-        if answer:
-            print(f"\n✓ Test completed ({len(answer)} chars)")
-        else:
-            print(f"\n✗ Test failed")
+                input("\nPress Enter to continue to next test...")
 
-        input("\nPress Enter to continue to next test...")
+    # Serial runs pause for Enter between tests, so only the query times count
+    suite_time = time.perf_counter() - suite_start if parallel else sum(t for _, t in timings)
+
+    print("\n" + "=" * 80)
+    print("⏱️  Query wall times:")
+    for name, elapsed in timings:
+        print(f"  {name:<28} {elapsed:6.2f}s")
+    print(f"  {'Total':<28} {suite_time:6.2f}s")
 
     print("\n" + "=" * 80)
     print("🎉 All tests completed!")
@@ -130,5 +175,17 @@ def main():
     print("=" * 80)
 
 
+def main():
+    parser = argparse.ArgumentParser(description="DocuMind AI accuracy test suite")
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Stream all queries concurrently without pausing between tests"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(amain(parallel=args.parallel))
+
+
 if __name__ == "__main__":
     main()